@@ -0,0 +1,240 @@
+#! /usr/bin/env python3
+
+
+###
+# File: benchmark.py
+#
+# Description: Times the stages of the downloader pipeline (fetch_teachings,
+#                fetch_courses, retrieve_timetables, export_calendar) and the
+#                whole pipeline, against the local fake datastore at growing
+#                scales: from a single course to a full university.
+#                The startup time (imports and --help) is measured too.
+#                The results are saved per version in benchmarks/results, so
+#                a later run can be compared with --compare.
+#
+# Author: Francesco Tosello
+###
+
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from datetime import datetime
+from io import StringIO
+from json import dump as dump_json, load as load_json
+from os import path, environ, makedirs, remove
+from re import search
+from socket import socket, create_connection
+from statistics import median
+from subprocess import Popen, run as run_process, check_output, DEVNULL, PIPE, CalledProcessError
+from tempfile import mkdtemp
+from time import perf_counter, sleep
+import platform
+import sys
+
+BENCHMARKS_DIRECTORY = path.dirname(path.abspath(__file__))
+PACKAGE_DIRECTORY = path.join(BENCHMARKS_DIRECTORY, '..', 'calendariounibo')
+sys.path.insert(0, PACKAGE_DIRECTORY)
+
+# Constants
+RESULTS_DIRECTORY = path.join(BENCHMARKS_DIRECTORY, "results")
+DEFAULT_SCALES = ['course', 'school']
+DEFAULT_REPEAT = 3
+START_DATE = "14-09-26" # around the fake semester, see fake_datastore.FIRST_LECTURE_DATE
+END_DATE = "31-03-27"
+FORK_REGEX = "A-K"
+STAGES = ['fetch_teachings', 'fetch_courses', 'retrieve_timetables', 'export_calendar', 'end_to_end']
+SERVER_STARTUP_TIMEOUT = 120 # seconds, the biggest datasets take a while to generate
+STARTUP_MODULES = ['downloader', 'batch', 'server'] # imported by the startup benchmark
+SLOWEST_IMPORTS = 5 # listed in the startup results
+
+
+def free_port():
+	with socket() as s:
+		s.bind(("127.0.0.1", 0))
+		return s.getsockname()[1]
+
+def start_datastore(scale, port):
+	'''
+	Run the fake datastore in another process, so it doesn't compete with the
+	 benchmark for the interpreter lock. Returns the process when it is ready.
+	'''
+	process = Popen([sys.executable, path.join(BENCHMARKS_DIRECTORY, "fake_datastore.py"), \
+		"--port", str(port), "--scale", scale], stdout = DEVNULL)
+	deadline = perf_counter() + SERVER_STARTUP_TIMEOUT
+	while perf_counter() < deadline:
+		try:
+			create_connection(("127.0.0.1", port), 1).close()
+			return process
+		except OSError:
+			if process.poll() is not None: break
+			sleep(0.1)
+	process.kill()
+	print("The fake datastore didn't start.")
+	exit(1)
+
+def current_version():
+	'''
+	Returns the version of the package and the current commit, if known.
+	'''
+	with open(path.join(PACKAGE_DIRECTORY, "__init__.py"), encoding = 'utf-8') as init_file:
+		version = search(r"__version__ = ['\"]([^'\"]*)['\"]", init_file.read()).group(1)
+	try:
+		commit = check_output(["git", "rev-parse", "--short", "HEAD"], cwd = BENCHMARKS_DIRECTORY, \
+			stderr = DEVNULL).decode().strip()
+	except (OSError, CalledProcessError):
+		commit = "unknown"
+	return version, commit
+
+def benchmark_startup(repeat = DEFAULT_REPEAT):
+	'''
+	Measure in new interpreters the import time of the scripts (with
+	 -X importtime) and the wall time of downloader.py --help.
+	Returns a dictionary with the best times (seconds) and the slowest
+	 imports of downloader.
+	'''
+	results = {}
+	slowest = []
+	for module in STARTUP_MODULES:
+		best = None
+		for i in range(repeat):
+			output = run_process([sys.executable, "-X", "importtime", "-c", "import " + module], \
+				cwd = PACKAGE_DIRECTORY, stdout = DEVNULL, stderr = PIPE).stderr.decode()
+			imports = [] # (self, cumulative, name) in microseconds
+			for line in output.splitlines():
+				fields = line.split('|')
+				if len(fields) != 3 or not fields[0].startswith("import time:"): continue
+				try:
+					imports.append((int(fields[0].split(':')[1]), int(fields[1]), fields[2].strip()))
+				except ValueError:
+					continue # the header
+			total = [i[1] for i in imports if i[2] == module]
+			if not total: break
+			if best is None or total[0] < best:
+				best = total[0]
+				if module == STARTUP_MODULES[0]: slowest = sorted(imports, reverse = True)[:SLOWEST_IMPORTS]
+		results["import_" + module] = None if best is None else best / 1e6
+	help_times = []
+	for i in range(repeat):
+		t0 = perf_counter()
+		run_process([sys.executable, path.join(PACKAGE_DIRECTORY, "downloader.py"), "--help"], \
+			cwd = PACKAGE_DIRECTORY, stdout = DEVNULL, stderr = DEVNULL)
+		help_times.append(perf_counter() - t0)
+	results['help'] = min(help_times)
+	results['slowest_imports'] = [{'module': name, 'self': own / 1e6, 'cumulative': cumulative / 1e6} \
+		for own, cumulative, name in slowest]
+	return results
+
+def benchmark_scale(scale, repeat = DEFAULT_REPEAT, limit = None, use_cache = False):
+	'''
+	Build every calendar (curriculum and year) of the fake datastore at this
+	 scale, repeat times. The downloader must already point to it.
+	Returns a dictionary with the timings (seconds) of every stage, summed
+	 over all the calendars.
+	'''
+	import downloader, cache, rooms, http_client, fragments
+	from api_constants import RESOURCE_CURRICULA_STRUCTURE, FIELD_CURRICULUM_CODE, FIELD_CURRICULUM_GROUP_YEAR
+	cache.configure(cache.MODE_DEFAULT if use_cache else cache.MODE_DISABLED, mkdtemp(prefix = "calendariounibo-"))
+	calendars = [(r[FIELD_CURRICULUM_CODE], int(r[FIELD_CURRICULUM_GROUP_YEAR])) \
+		for r in downloader.iter_records(RESOURCE_CURRICULA_STRUCTURE)][:limit]
+	filename = path.join(mkdtemp(prefix = "calendariounibo-"), "benchmark.ics")
+	runs = {stage: [] for stage in STAGES}
+	lectures = 0
+	for i in range(repeat):
+		rooms.directory = None # every run starts from scratch
+		fragments.fragment_cache.clear()
+		http_client.statistics.clear()
+		totals = dict.fromkeys(STAGES, 0.0)
+		lectures = 0
+		with redirect_stdout(StringIO()):
+			for curriculum, year in calendars:
+				t0 = perf_counter()
+				teachings = downloader.fetch_teachings(curriculum, year)
+				t1 = perf_counter()
+				courses = downloader.fetch_courses(teachings, FORK_REGEX)
+				t2 = perf_counter()
+				timetables = downloader.retrieve_timetables(courses, START_DATE, END_DATE)
+				t3 = perf_counter()
+				downloader.export_calendar(courses, timetables, filename)
+				t4 = perf_counter()
+				for stage, elapsed in zip(STAGES, [t1 - t0, t2 - t1, t3 - t2, t4 - t3, t4 - t0]):
+					totals[stage] += elapsed
+				lectures += len(timetables)
+		for stage in STAGES: runs[stage].append(totals[stage])
+	remove(filename)
+	http_client.close_all()
+	transferred = sum(s[1] for s in http_client.statistics.values())
+	return {
+		'calendars': len(calendars),
+		'lectures': lectures,
+		'transferred_bytes': transferred,
+		'stages': {stage: {'min': min(r), 'median': median(r), 'runs': r} for stage, r in runs.items()},
+	}
+
+def print_results(results, baseline = None):
+	startup = results.get('startup')
+	if startup:
+		old = (baseline or {}).get('startup', {})
+		print("startup:")
+		for key, value in startup.items():
+			if key == 'slowest_imports' or value is None: continue
+			line = "  {:<20} {:9.3f} s".format(key, value)
+			if old.get(key): line += "  ({:+.1%} vs {})".format(value / old[key] - 1, baseline['commit'])
+			print(line)
+		for i in startup['slowest_imports']:
+			print("    {:<30} {:7.1f} ms".format(i['module'], i['self'] * 1000))
+	for scale, result in results['scales'].items():
+		print("{}: {:d} calendars, {:d} lectures, {:.1f} kB transferred".format(scale, result['calendars'], \
+			result['lectures'], result['transferred_bytes'] / 1000))
+		old = (baseline or {}).get('scales', {}).get(scale)
+		for stage, timing in result['stages'].items():
+			line = "  {:<20} {:9.3f} s".format(stage, timing['min'])
+			if old and stage in old['stages'] and old['stages'][stage]['min']:
+				line += "  ({:+.1%} vs {})".format(timing['min'] / old['stages'][stage]['min'] - 1, \
+					baseline['commit'])
+			print(line)
+
+def save_results(results, directory = RESULTS_DIRECTORY):
+	makedirs(directory, exist_ok = True)
+	filename = path.join(directory, "{}-{}.json".format(results['version'], results['commit']))
+	with open(filename, 'w') as results_file:
+		dump_json(results, results_file, indent = 1)
+	return filename
+
+def run(scales = DEFAULT_SCALES, repeat = DEFAULT_REPEAT, limit = None, use_cache = False, startup = True):
+	version, commit = current_version()
+	results = {'version': version, 'commit': commit, 'date': datetime.today().isoformat(timespec = 'seconds'), \
+		'python': platform.python_version(), 'repeat': repeat, 'scales': {}}
+	if startup: results['startup'] = benchmark_startup(repeat)
+	port = free_port()
+	environ['CALENDARIOUNIBO_API_URL'] = "http://127.0.0.1:{:d}/".format(port) # read when api_constants is imported
+	for scale in scales:
+		process = start_datastore(scale, port)
+		try:
+			results['scales'][scale] = benchmark_scale(scale, repeat, limit, use_cache)
+		finally:
+			process.terminate()
+			process.wait()
+	return results
+
+def parse_args():
+	parser = ArgumentParser(description = "Benchmark the downloader against a local fake datastore.")
+	parser.add_argument('-s', '--scale', dest = 'scales', action = 'append', \
+		choices = ['course', 'school', 'university'], help = "Run at this scale (repeatable). Default course and school.")
+	parser.add_argument('-r', '--repeat', type = int, default = DEFAULT_REPEAT, help = "Runs of every scale, the best one counts.")
+	parser.add_argument('-l', '--limit', type = int, help = "Build at most this number of calendars for every scale.")
+	parser.add_argument('--cache', action = 'store_true', help = "Use the on-disk cache (a new one), the runs after the first hit it.")
+	parser.add_argument('--compare', help = "Compare with the results of another version (a json file in benchmarks/results).")
+	parser.add_argument('--no-startup', action = 'store_true', help = "Do not measure the startup time.")
+	parser.add_argument('--no-save', action = 'store_true', help = "Do not store the results.")
+	args = parser.parse_args()
+	baseline = None
+	if args.compare:
+		with open(args.compare) as baseline_file:
+			baseline = load_json(baseline_file)
+	return args.scales or DEFAULT_SCALES, args.repeat, args.limit, args.cache, not args.no_startup, baseline, \
+		not args.no_save
+
+if __name__ == '__main__':
+	scales, repeat, limit, use_cache, startup, baseline, save = parse_args()
+	results = run(scales, repeat, limit, use_cache, startup)
+	print_results(results, baseline)
+	if save: print("Saved to {}.".format(save_results(results)))
@@ -0,0 +1,298 @@
+#! /usr/bin/env python3
+
+
+###
+# File: fake_datastore.py
+#
+# Description: A local stand-in for the dati.unibo.it datastore API, serving
+#                synthetic curricula, teaching trees (with modules and forks),
+#                timetables and rooms at a configurable scale. It answers
+#                datastore_search, datastore_search_sql (the dialect written
+#                by downloader.build_sql) and resource_show.
+#
+# Note: Point the scripts to it with the CALENDARIOUNIBO_API_URL environment
+#        variable, e.g. CALENDARIOUNIBO_API_URL=http://localhost:8765/
+#        (their cache is then kept apart, see cache.CACHE_DIRECTORY).
+#
+# Author: Francesco Tosello
+###
+
+from argparse import ArgumentParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from json import loads as parse_json, dumps as to_json_bytes
+from datetime import datetime, timedelta
+from gzip import compress
+from random import Random
+from re import compile as compile_regex
+from threading import Thread
+import sys
+from os import path
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', 'calendariounibo'))
+from api_constants import *
+
+# Constants
+DEFAULT_PORT = 8765
+DEFAULT_SEED = 1
+FIRST_LECTURE_DATE = "2026-09-21" # monday, first week of the semester
+DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+SEMESTER_WEEKS = 12
+YEARS = 3
+GZIP_MIN_SIZE = 1024 # bytes, like a typical web server configuration
+ID_COLUMN = "_id"
+
+SCALES = { # name -> (courses, curricula per course, teachings per year, rooms)
+	'course': (1, 1, 8, 20),
+	'school': (20, 2, 8, 300),
+	'university': (220, 2, 10, 2500),
+}
+
+SQL_REGEX = compile_regex(r'^SELECT (.+?) FROM "([^"]+)"(?: WHERE (.+?))? ORDER BY "_id" LIMIT (\d+) OFFSET (\d+)$')
+SQL_IN_REGEX = compile_regex(r'^"([^"]+)" IN \((.*)\)$')
+SQL_RANGE_REGEX = compile_regex(r'^"([^"]+)" (>=|<=) \'(.*)\'$')
+SQL_LITERAL_REGEX = compile_regex(r"'((?:[^']|'')*)'")
+SQL_IDENTIFIER_REGEX = compile_regex(r'"([^"]+)"')
+
+SUBJECTS = ["ANALISI MATEMATICA", "ALGEBRA E GEOMETRIA", "PROGRAMMAZIONE", "ARCHITETTURA DEGLI ELABORATORI", \
+	"BASI DI DATI", "FISICA", "CALCOLO NUMERICO", "LOGICA", "SISTEMI OPERATIVI", "RETI DI CALCOLATORI", \
+	"ECONOMIA AZIENDALE", "DIRITTO PRIVATO", "CHIMICA GENERALE", "STATISTICA", "LINGUA INGLESE"]
+TEACHERS = ["MARIO ROSSI", "LUIGI BIANCHI", "ANNA VERDI", "GIULIA NERI", "PAOLO GIALLI", "SARA BRUNO"]
+STREETS = ["Via Zamboni", "Viale Risorgimento", "Via Irnerio", "Via Belmeloro", "Via Terracini"]
+
+
+def generate(courses = 1, curricula = 1, teachings = 8, room_count = 20, seed = DEFAULT_SEED):
+	'''
+	Generate the synthetic datasets.
+	Every year of a curriculum has some teachings: a third of them is split
+	 in modules and another third in forks, every leaf has two lectures a
+	 week for the whole semester (with a skipped week and a final exam).
+	Returns a dictionary: resource -> list of records.
+	'''
+	random = Random(seed)
+	data = {r: [] for r in [RESOURCE_CURRICULA_AVAILABLE, RESOURCE_CURRICULA_STRUCTURE, RESOURCE_CURRICULA_DETAILS, \
+		RESOURCE_TEACHING_DETAILS, RESOURCE_TIMETABLES, RESOURCE_ROOMS]}
+	for r in range(room_count):
+		data[RESOURCE_ROOMS].append({FIELD_ROOMS_ROOM_ID: "R{:05d}".format(r), FIELD_ROOMS_NAME: "AULA {:d}".format(r), \
+			FIELD_ROOMS_ADDRESS: "{}, {:d}".format(random.choice(STREETS), r % 50 + 1), \
+			FIELD_ROOMS_FLOOR: "Piano {:d}".format(r % 4), FIELD_ROOMS_LATITUDE: 44.49 + random.random() / 100, \
+			FIELD_ROOMS_LONGITUDE: 11.34 + random.random() / 100})
+	first_day = datetime.strptime(FIRST_LECTURE_DATE, "%Y-%m-%d")
+	component = 100000
+	for c in range(courses):
+		course_code = "{:04d}".format(8000 + c)
+		for k in range(curricula):
+			curriculum = "Manifesto-2026_{}_{:03d}_000_2026".format(course_code, k)
+			data[RESOURCE_CURRICULA_AVAILABLE].append({FIELD_CURRICULUM_COURSE_CODE: course_code, \
+				FIELD_CURRICULUM_COURSE_DESCRIPTION: "CORSO {}".format(course_code), FIELD_CURRICULUM_CODE: curriculum, \
+				FIELD_CURRICULUM_DESCRIPTION: "CURRICULUM {:d}".format(k), FIELD_CURRICULUM_NOTES: None, \
+				FIELD_CURRICULUM_URL: "https://corsi.unibo.it/{}".format(course_code)})
+			for year in range(1, YEARS + 1):
+				data[RESOURCE_CURRICULA_STRUCTURE].append({FIELD_CURRICULUM_CODE: curriculum, \
+					FIELD_CURRICULUM_GROUP_YEAR: year, FIELD_CURRICULUM_GROUP_ID: "{}_{:d}".format(curriculum, year), \
+					FIELD_CURRICULUM_GROUP_FATHER: None, FIELD_GROUP_MAX_CFU: 60, FIELD_GROUP_MIN_CFU: 60, \
+					FIELD_GROUP_MANDATORY: FIELD_GROUP_MANDATORY_YES})
+				for t in range(teachings):
+					component += 1
+					root = component
+					subject = "{} {:d}".format(SUBJECTS[(c + t) % len(SUBJECTS)], year)
+					subject_code = "{:05d}".format(root % 100000)
+					data[RESOURCE_CURRICULA_DETAILS].append({FIELD_CURRICULUM_CODE: curriculum, \
+						FIELD_CURRICULUM_YEAR: year, FIELD_CURRICULUM_SUBJECT_CODE: subject_code, \
+						FIELD_CURRICULUM_SUBJECT_DESCRIPTION: subject, FIELD_CURRICULUM_TEACHING_NOTES: None, \
+						FIELD_CURRICULUM_TEACHING_PERIOD: "1 semestre", FIELD_CURRICULUM_TEACHING_CFU: 6, \
+						FIELD_CURRICULUM_TEACHING_ID: root, FIELD_CURRICULUM_ACTIVE: t % 7 != 6})
+
+					def teaching(component_id, father, kind, description):
+						data[RESOURCE_TEACHING_DETAILS].append({FIELD_TEACHING_COURSE_CODE: course_code, \
+							FIELD_TEACHING_SUBJECT_CODE: subject_code, FIELD_TEACHING_SUBJECT_DESCRIPTION: description, \
+							FIELD_TEACHING_URL: "https://www.unibo.it/insegnamenti/{:d}".format(component_id), \
+							FIELD_TEACHING_TYPE: kind, FIELD_TEACHING_TEACHER_CODE: str(component_id % 997), \
+							FIELD_TEACHING_TEACHER_NAME: random.choice(TEACHERS), FIELD_TEACHING_LANGUAGE: "ita", \
+							FIELD_TEACHING_ID: component_id, FIELD_TEACHING_FATHER_ID: father, FIELD_TEACHING_ROOT_ID: root})
+
+					teaching(root, None, None, "{} (CDS {})".format(subject, course_code))
+					leaves = [root]
+					if t % 3 == 1: # integrated course
+						leaves = []
+						for m in range(2):
+							component += 1
+							teaching(component, root, FIELD_TEACHING_TYPE_PART, "{} MODULO {:d}".format(subject, m + 1))
+							leaves.append(component)
+					elif t % 3 == 2: # forked course
+						leaves = []
+						for group in ["A-K", "L-Z"]:
+							component += 1
+							teaching(component, root, FIELD_TEACHING_TYPE_FORK, "{} ({})".format(subject, group))
+							leaves.append(component)
+					for leaf in leaves:
+						rooms = " ".join(random.choice(data[RESOURCE_ROOMS])[FIELD_ROOMS_ROOM_ID] \
+							for _ in range(1 if random.random() < 0.9 else 2))
+						days = random.sample(range(5), 2)
+						hour = 9 + random.randrange(8)
+						for week in range(SEMESTER_WEEKS):
+							if week == 6: continue # holidays
+							for day in days:
+								start = first_day + timedelta(days = 7 * week + day, hours = hour)
+								data[RESOURCE_TIMETABLES].append({FIELD_TIMETABLE_TEACHING_ID: leaf, \
+									FIELD_TIMETABLE_START: start.strftime(DATETIME_FORMAT), \
+									FIELD_TIMETABLE_END: (start + timedelta(hours = 2)).strftime(DATETIME_FORMAT), \
+									FIELD_TIMETABLE_ROOM_ID: rooms, FIELD_TIMETABLE_NOTES: None})
+						exam = first_day + timedelta(days = 7 * SEMESTER_WEEKS + 14, hours = 9)
+						data[RESOURCE_TIMETABLES].append({FIELD_TIMETABLE_TEACHING_ID: leaf, \
+							FIELD_TIMETABLE_START: exam.strftime(DATETIME_FORMAT), \
+							FIELD_TIMETABLE_END: (exam + timedelta(hours = 3)).strftime(DATETIME_FORMAT), \
+							FIELD_TIMETABLE_ROOM_ID: rooms, FIELD_TIMETABLE_NOTES: "esame"})
+	for records in data.values():
+		for i, record in enumerate(records): record[ID_COLUMN] = i + 1
+	return data
+
+
+class Datastore():
+	'''
+	Answers the queries over the generated datasets, with an index for every
+	 filtered field, built on demand.
+	'''
+	def __init__(self, data):
+		self.data = data
+		self.indexes = {}
+		self.modified = datetime.today().strftime(DATETIME_FORMAT)
+
+	def index(self, resource, field):
+		key = (resource, field)
+		if key not in self.indexes:
+			index = {}
+			for position, record in enumerate(self.data[resource]):
+				index.setdefault(str(record.get(field)), []).append(position)
+			self.indexes[key] = index
+		return self.indexes[key]
+
+	def select(self, resource, filters = {}, ranges = []):
+		'''
+		Returns the records matching all the filters (field -> list of values)
+		 and ranges (field, operator, value), in _id order.
+		'''
+		records = self.data[resource]
+		positions = None
+		for field, values in filters.items():
+			index = self.index(resource, field)
+			matches = set(p for v in values for p in index.get(str(v), []))
+			positions = matches if positions is None else positions & matches
+		selected = [records[p] for p in sorted(positions)] if positions is not None else records
+		for field, operator, value in ranges:
+			if operator == '>=':
+				selected = [r for r in selected if str(r.get(field)) >= value]
+			else:
+				selected = [r for r in selected if str(r.get(field)) <= value]
+		return selected
+
+	def search(self, query):
+		resource = query[RESOURCE_PARAMETER]
+		if resource not in self.data: return None
+		filters = {f: v if isinstance(v, list) else [v] for f, v in (query.get(FILTERS_PARAMETER) or {}).items()}
+		selected = self.select(resource, filters)
+		offset = int(query.get(OFFSET_PARAMETER, 0))
+		limit = int(query.get(LIMIT_PARAMETER, 100))
+		return {'records': project(selected[offset:offset+limit], query.get(FIELDS_PARAMETER)), 'total': len(selected)}
+
+	def search_sql(self, sql):
+		match = SQL_REGEX.match(sql)
+		if not match: return None
+		columns, resource, where, limit, offset = match.groups()
+		if resource not in self.data: return None
+		filters = {}
+		ranges = []
+		for condition in (where.split(" AND ") if where else []):
+			inside = SQL_IN_REGEX.match(condition)
+			if inside:
+				filters[inside.group(1)] = [v.replace("''", "'") for v in SQL_LITERAL_REGEX.findall(inside.group(2))]
+				continue
+			bound = SQL_RANGE_REGEX.match(condition)
+			if not bound: return None
+			ranges.append(bound.groups())
+		selected = self.select(resource, filters, ranges)[int(offset):int(offset)+int(limit)]
+		fields = None if columns == "*" else SQL_IDENTIFIER_REGEX.findall(columns)
+		return {'records': project(selected, fields)}
+
+	def show(self, resource):
+		if resource not in self.data: return None
+		return {'id': resource, FIELD_RESOURCE_LAST_MODIFIED: self.modified}
+
+
+def project(records, fields):
+	if not fields: return records
+	if isinstance(fields, str): fields = fields.split(",")
+	return [{f: r.get(f) for f in fields} for r in records]
+
+
+class DatastoreHandler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+	disable_nagle_algorithm = True # headers and body are sent apart, don't wait for the delayed ack
+
+	def log_message(self, *args):
+		pass
+
+	def do_POST(self):
+		try:
+			query = parse_json(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+			action = self.path.rstrip('/').rsplit('/', 1)[-1]
+			if action == "datastore_search_sql":
+				result = self.server.datastore.search_sql(query.get(SQL_PARAMETER, ""))
+			elif action == "resource_show":
+				result = self.server.datastore.show(query.get(ID_PARAMETER))
+			else:
+				result = self.server.datastore.search(query)
+		except (ValueError, KeyError) as e:
+			result = None
+		if result is None:
+			self.send_json(409, {'success': False, 'error': {'message': "Bad query."}})
+		else:
+			self.send_json(200, {'success': True, 'result': result})
+
+	def send_json(self, status, response):
+		body = to_json_bytes(response).encode()
+		self.send_response(status)
+		self.send_header('Content-Type', "application/json")
+		if self.server.gzip and len(body) >= GZIP_MIN_SIZE and 'gzip' in self.headers.get('Accept-Encoding', ''):
+			body = compress(body, 6)
+			self.send_header('Content-Encoding', "gzip")
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+
+class DatastoreServer(ThreadingHTTPServer):
+	daemon_threads = True
+
+	def __init__(self, address, data, gzip = True):
+		super().__init__(address, DatastoreHandler)
+		self.datastore = Datastore(data)
+		self.gzip = gzip
+
+	def url(self):
+		return "http://{}:{:d}/".format(*self.server_address[:2])
+
+def start(data, port = 0, gzip = True):
+	'''
+	Serve the data in a background thread. Returns the server, see its url.
+	'''
+	server = DatastoreServer(("127.0.0.1", port), data, gzip)
+	Thread(target = server.serve_forever, daemon = True).start()
+	return server
+
+def parse_args():
+	parser = ArgumentParser(description = "Serve synthetic datasets like the UniBo datastore.")
+	parser.add_argument('-p', '--port', type = int, default = DEFAULT_PORT, help = "Listen on this port.")
+	parser.add_argument('-s', '--scale', choices = sorted(SCALES), default = 'course', help = "Size of the datasets.")
+	parser.add_argument('--seed', type = int, default = DEFAULT_SEED, help = "Random seed of the datasets.")
+	parser.add_argument('--no-gzip', action = 'store_true', help = "Never compress the responses.")
+	args = parser.parse_args()
+	return args.port, args.scale, args.seed, not args.no_gzip
+
+if __name__ == '__main__':
+	port, scale, seed, gzip = parse_args()
+	server = DatastoreServer(("127.0.0.1", port), generate(*SCALES[scale], seed = seed), gzip)
+	print("Serving the {} datasets on {}".format(scale, server.url()))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
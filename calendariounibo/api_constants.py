@@ -5,11 +5,24 @@
 #                urls, datasets, resources and fields strings
 ###
 
-DATA_QUERY_URL = "https://dati.unibo.it/api/action/datastore_search"
+from os import environ as _environ # not exported by the star imports
+
+DEFAULT_API_URL = "https://dati.unibo.it/api/action/"
+API_URL = _environ.get("CALENDARIOUNIBO_API_URL", DEFAULT_API_URL) # e.g. benchmarks/fake_datastore.py, see also cache.py
+DATA_QUERY_URL = API_URL + "datastore_search"
+DATA_SQL_URL = API_URL + "datastore_search_sql"
+RESOURCE_SHOW_URL = API_URL + "resource_show"
+ID_PARAMETER = "id"
+FIELD_RESOURCE_LAST_MODIFIED = "last_modified" # of the resource metadata, see resource_show
+FIELD_RESOURCE_METADATA_MODIFIED = "metadata_modified"
+SQL_PARAMETER = "sql"
 RESOURCE_PARAMETER = "resource_id"
 FILTERS_PARAMETER = "filters"
 FIELDS_PARAMETER = "fields"
 LIMIT_PARAMETER = "limit"
+OFFSET_PARAMETER = "offset"
+SORT_PARAMETER = "sort"
+FIELD_RECORD_ID = "_id" # added by the datastore to every record, gives a stable order to the pages
 
 # In the following 'resources' you may use '2018' instead of 'latest'
 RESOURCE_CURRICULA_AVAILABLE = "curriculadisponibili_latest_it" # update: every day
@@ -21,7 +34,7 @@ FIELD_CURRICULUM_NOTES = "curriculum_note" # string
 FIELD_CURRICULUM_URL = "url" # string - not null
 
 RESOURCE_CURRICULA_STRUCTURE = "curriculastruttura_latest_it" # update: every day
-FIELD_CURRICULUM_GROUP_YEAR = "annno" # integer - not null
+FIELD_CURRICULUM_GROUP_YEAR = "annno" # integer - not null (sic, see also FIELD_CURRICULUM_YEAR and records.CurriculumGroup)
 FIELD_CURRICULUM_GROUP_ID = "gruppo_id" # string - not null, primary unique
 FIELD_CURRICULUM_GROUP_FATHER = "gruppo_padre" # string
 FIELD_GROUP_MAX_CFU = "cfu_massimo" # integer - not null
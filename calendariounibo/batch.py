@@ -0,0 +1,187 @@
+#! /usr/bin/env python3
+
+
+###
+# File: batch.py
+#
+# Description: Builds many calendars in a single run. The jobs are read from a
+#                manifest, every dataset is downloaded just once for all of
+#                them and the calendars are exported in parallel processes.
+#
+# Author: Francesco Tosello
+###
+
+###
+# Manifest format (json):
+#
+# [
+#   {"curriculum": "Manifesto-2018_8010_000_000_2017", "year": 2, "filename": "8010-2.ics"},
+#   {"curriculum": "...", "year": 1, "teachings": ["analisi", 323944], "fork_regex": "A-K",
+#     "inactive": false, "forks": {"<father id>": "<chosen id>"}, "filename": "..."},
+#   ...
+# ]
+#
+# Nothing is asked: the forks not decided by fork_regex or forks are all
+# followed, as in server.py.
+###
+
+from api_constants import *
+from argparse import ArgumentParser
+from json import load as load_json
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from os import path
+import downloader
+from downloader import iter_records, columns, select_teachings, teachings_index, fetch_teaching_trees, resolve_courses, load_fork_choices, \
+	retrieve_timetables, export_calendar, render_fragments, add_source_arguments, configure_source
+from records import CurriculumTeaching
+import cache
+import fragments
+from scheduler import DatastoreError
+
+# Constants
+JOB_CURRICULUM = "curriculum"
+JOB_YEAR = "year"
+JOB_TEACHINGS = "teachings"
+JOB_FORK_REGEX = "fork_regex"
+JOB_INACTIVE = "inactive"
+JOB_FORKS = "forks" # saved fork choices, either a dictionary or a file (see downloader.py --forks)
+JOB_FILENAME = "filename"
+
+
+def load_manifest(filename):
+	'''
+	Read the list of jobs from a manifest file.
+	'''
+	try:
+		with open(filename) as manifest:
+			jobs = load_json(manifest)
+	except (IOError, ValueError) as e:
+		print("Unable to read the manifest: {}".format(e))
+		exit(1)
+	for i, job in enumerate(jobs):
+		if JOB_CURRICULUM not in job or not (job.get(JOB_YEAR) or job.get(JOB_TEACHINGS)):
+			print("Job {:d} needs a curriculum and either an year or some teachings.".format(i+1))
+			exit(2)
+		job.setdefault(JOB_FILENAME, "{}-{}.ics".format(job[JOB_CURRICULUM], job.get(JOB_YEAR, 0)))
+	return jobs
+
+def export_job(courses, timetables, filename, incremental = False, weekly = False):
+	'''
+	Export a single calendar, runs in a worker process.
+	Returns None if successful or the exit code.
+	'''
+	try:
+		export_calendar(courses, timetables, filename, incremental = incremental, weekly = weekly)
+	except SystemExit as e:
+		return e.code
+	return None
+
+def run(jobs, start = None, end = None, coordinates = False, workers = None, \
+	incremental = False, weekly = False, fragments_file = None):
+	'''
+	Build the calendars for these jobs.
+	The events of all the lectures are rendered once, before starting the
+	 export processes: they are forked, so they inherit them (see
+	 fragments.py), and the fragments_file keeps them for the next runs.
+	Where fork is not available (Windows) every process renders its own.
+	Returns the number of failed jobs.
+	'''
+	curricula = sorted(set(str(job[JOB_CURRICULUM]) for job in jobs))
+	details = {}
+	for t in iter_records(RESOURCE_CURRICULA_DETAILS, {FIELD_CURRICULUM_CODE: curricula}, \
+		columns(CurriculumTeaching)):
+		t = CurriculumTeaching.from_record(t)
+		details.setdefault(t.curriculum, []).append(t)
+
+	failed = 0
+	indexes = {} # curriculum -> index of the names, shared by its jobs
+	selections = [] # teachings of every job, None if the job has been discarded
+	for job in jobs:
+		curriculum = str(job[JOB_CURRICULUM])
+		index = None
+		if job.get(JOB_TEACHINGS):
+			if curriculum not in indexes: indexes[curriculum] = teachings_index(details.get(curriculum, []))
+			index = indexes[curriculum]
+		teachings = select_teachings(details.get(curriculum, []), job.get(JOB_YEAR, 0), \
+			job.get(JOB_TEACHINGS, []), job.get(JOB_INACTIVE, False), index)
+		if not teachings:
+			print("No teaching has been found for {}.".format(job[JOB_FILENAME]))
+			failed += 1
+		selections.append(teachings or None)
+	del details, indexes
+
+	ldict = fetch_teaching_trees([t for teachings in selections if teachings for t in teachings])
+	all_courses = {}
+	for i, job in enumerate(jobs):
+		if selections[i] is None: continue
+		fork_choices = job.get(JOB_FORKS)
+		if isinstance(fork_choices, str): fork_choices = load_fork_choices(fork_choices)
+		selections[i] = resolve_courses(selections[i], ldict, job.get(JOB_FORK_REGEX), \
+			{str(k): str(v) for k, v in (fork_choices or {}).items()}, interactive = False) # nobody to ask, e.g. in cron
+		for c in selections[i]: all_courses.setdefault(c.id, c)
+	del ldict
+	if not all_courses:
+		print("Nothing to export.")
+		return failed
+
+	timetables = {}
+	for lecture in retrieve_timetables(list(all_courses.values()), start, end, coordinates):
+		timetables.setdefault(lecture.course_id, []).append(lecture)
+	if not timetables:
+		print("No lectures found in the selected dates.")
+		return failed + len([s for s in selections if s is not None])
+
+	if fragments_file: fragments.fragment_cache.load(fragments_file)
+	for course_timetables in timetables.values():
+		render_fragments(all_courses, course_timetables, weekly)
+	if fragments_file: fragments.fragment_cache.save(fragments_file)
+
+	try:
+		context = get_context('fork') # the default start method is spawn on macOS, forkserver since Python 3.14
+	except ValueError:
+		context = None
+	with ProcessPoolExecutor(workers, mp_context = context) as executor:
+		futures = []
+		for job, courses in zip(jobs, selections):
+			if courses is None: continue
+			records = [r for c in courses for r in timetables.get(c.id, [])]
+			records.sort(key = lambda r: r.start)
+			futures.append((job[JOB_FILENAME], executor.submit(export_job, courses, records, job[JOB_FILENAME], \
+				incremental, weekly)))
+		for filename, future in futures:
+			code = future.result()
+			if code:
+				failed += 1
+			else:
+				print("Exported to {}.".format(filename))
+	return failed
+
+def parse_args():
+	parser = ArgumentParser(description = "Export many calendars at once.", epilog = "written by " + downloader.__AUTHOR__)
+	parser.add_argument('manifest', help = "A json file with the list of calendars to export.")
+	parser.add_argument('--from', '--from-date', dest = 'from_date', \
+		help = "Start date, format dd-mm-yy. Default today.")
+	parser.add_argument('--to', '--to-date', \
+		help = "End date, format dd-mm-yy. Default approximatively 10 years (aka no end).")
+	parser.add_argument('--coordinates', action = 'store_true', help = "Instead of the address store the gps coordinates of the classroom.")
+	parser.add_argument('-i', '--incremental', action = 'store_true', \
+		help = "Update the previous calendars, rewriting only the lectures that changed.")
+	parser.add_argument('-W', '--weekly', action = 'store_true', \
+		help = "Export the lectures repeating every week as recurring events.")
+	parser.add_argument('--fragments', action = 'store_true', \
+		help = "Keep the rendered events in the cache directory, for the next runs.")
+	parser.add_argument('-w', '--workers', type = int, help = "Number of export processes. Default one per cpu.")
+	add_source_arguments(parser)
+	args = parser.parse_args()
+	configure_source(args)
+	return load_manifest(args.manifest), args.from_date, args.to, args.coordinates, args.workers, \
+		args.incremental, args.weekly, \
+		path.join(cache.directory, fragments.FRAGMENTS_FILENAME) if args.fragments else None
+
+if __name__ == '__main__':
+	try:
+		exit(3 if run(*parse_args()) else 0)
+	except DatastoreError as e:
+		print(e)
+		exit(1)
@@ -0,0 +1,126 @@
+###
+# File: cache.py
+#
+# Description: A persistent on-disk cache for the datastore responses.
+#                Every entry is addressed by the hash of its query, expires
+#                after the time to live of its resource and the least recently
+#                used entries are evicted when the cache grows too big.
+#
+# Author: Francesco Tosello
+###
+
+from api_constants import *
+from os import path, makedirs, listdir, remove, replace, stat, utime, environ
+from hashlib import sha256
+from json import dumps as to_json_bytes
+from time import time
+
+# Constants
+CACHE_DIRECTORY = path.join(environ.get('XDG_CACHE_HOME', path.join(path.expanduser('~'), '.cache')), \
+	'calendariounibo')
+if API_URL != DEFAULT_API_URL: # another server (e.g. a fake one) must not fill the real cache
+	CACHE_DIRECTORY += "-" + sha256(API_URL.encode()).hexdigest()[:12]
+CACHE_MAX_SIZE = 64 * 1024 * 1024 # bytes
+CACHE_EXTENSION = ".json"
+
+HOUR = 3600 # seconds
+DAY = 24 * HOUR
+DEFAULT_TTL = DAY
+RESOURCE_TTL = { # seconds, see the update frequencies in api_constants.py
+	RESOURCE_CURRICULA_AVAILABLE: DAY,
+	RESOURCE_CURRICULA_STRUCTURE: DAY,
+	RESOURCE_CURRICULA_DETAILS: DAY,
+	RESOURCE_TEACHING_DETAILS: DAY,
+	RESOURCE_TIMETABLES: DAY,
+	RESOURCE_ROOMS: DAY, # see also the rooms directory, rooms.py
+}
+
+MODE_DEFAULT = "default" # read fresh entries, write the new ones
+MODE_REFRESH = "refresh" # always ask the server, then update the cache
+MODE_OFFLINE = "offline" # never ask the server, even stale entries are fine
+MODE_DISABLED = "disabled" # neither read nor write
+
+mode = MODE_DEFAULT
+directory = CACHE_DIRECTORY
+max_size = CACHE_MAX_SIZE
+
+
+def configure(cache_mode = None, cache_directory = None, cache_max_size = None):
+	'''
+	Change the cache settings, the omitted parameters are left untouched.
+	'''
+	global mode, directory, max_size
+	if cache_mode: mode = cache_mode
+	if cache_directory: directory = cache_directory
+	if cache_max_size is not None: max_size = int(cache_max_size)
+
+def query_key(resource, filters = {}, fields = [], limit = 0, offset = 0, sql = None, sort = None):
+	'''
+	Returns the content address (an hex string) of a query.
+	The values of a filter are an alternative so their order doesn't matter.
+	'''
+	filters = {k: sorted(str(x) for x in v) if isinstance(v, (list, tuple, set)) else v \
+		for k, v in (filters or {}).items()}
+	query = [resource, filters, list(fields or []), int(limit), int(offset)]
+	if sql: query.append(sql)
+	if sort: query.append({SORT_PARAMETER: sort})
+	return sha256(to_json_bytes(query, sort_keys = True).encode()).hexdigest()
+
+def entry_path(key):
+	return path.join(directory, key + CACHE_EXTENSION)
+
+def load(resource, key):
+	'''
+	Returns the cached response body (bytes) for this key, None if it is missing
+	 or expired. In offline mode the entries never expire.
+	'''
+	if mode in (MODE_REFRESH, MODE_DISABLED): return None
+	filename = entry_path(key)
+	try:
+		info = stat(filename)
+		if mode != MODE_OFFLINE and time() - info.st_mtime > RESOURCE_TTL.get(resource, DEFAULT_TTL):
+			return None
+		with open(filename, 'rb') as entry:
+			body = entry.read()
+		utime(filename, (time(), info.st_mtime)) # the access time keeps the LRU order
+		return body
+	except (IOError, OSError):
+		return None
+
+def store(resource, key, body):
+	'''
+	Save a response body in the cache, then make room if needed.
+	Failures are not fatal: the cache is just an optimization.
+	'''
+	if mode in (MODE_OFFLINE, MODE_DISABLED): return
+	filename = entry_path(key)
+	try:
+		makedirs(directory, exist_ok = True)
+		with open(filename + ".tmp", 'wb') as entry:
+			entry.write(body)
+		replace(filename + ".tmp", filename) # never leave a truncated entry
+	except (IOError, OSError) as ioe:
+		print("Unable to write the cache: {}".format(ioe))
+		return
+	evict()
+
+def evict():
+	'''
+	Remove the least recently used entries until the cache fits in max_size.
+	'''
+	try:
+		entries = []
+		for name in listdir(directory):
+			if not name.endswith(CACHE_EXTENSION): continue
+			info = stat(path.join(directory, name))
+			entries.append((info.st_atime, info.st_size, name))
+	except (IOError, OSError):
+		return
+	size = sum(e[1] for e in entries)
+	for atime, esize, name in sorted(entries):
+		if size <= max_size: break
+		try:
+			remove(path.join(directory, name))
+			size -= esize
+		except (IOError, OSError):
+			pass
@@ -0,0 +1,175 @@
+###
+# File: catalog.py
+#
+# Description: A catalog of all the curricula with their years, built from
+#                the available curricula and their structure, kept on disk
+#                next to the cache and refreshed every day. A degree code (or
+#                the first digits of it) and the words of the descriptions
+#                are looked up in memory, without asking the server.
+#
+# Author: Francesco Tosello
+###
+
+from api_constants import *
+from bisect import bisect_left, bisect_right
+from os import path, makedirs, replace, stat
+from json import loads as parse_json, dumps as to_json_bytes
+from threading import Lock
+from time import time
+from records import Curriculum, CurriculumGroup
+from search import TeachingIndex
+from scheduler import DatastoreError
+import cache
+import snapshot
+
+# Constants
+CATALOG_FILENAME = "curricula.catalog" # not CACHE_EXTENSION, it must not be evicted
+CATALOG_TTL = cache.DAY
+
+catalog = None # loaded on demand, see get_catalog
+catalog_lock = Lock()
+
+
+def describe(curriculum):
+	'''
+	Returns the text searched by Catalog.search for a curriculum.
+	'''
+	return " ".join(t for t in (curriculum.course_description, curriculum.description, curriculum.notes) if t)
+
+
+class Catalog():
+	'''
+	The curricula sorted by degree code, indexed by the prefixes of the
+	 codes and (from the first search) of the words of their descriptions.
+	'''
+	def __init__(self, curricula, years):
+		self.curricula = sorted(curricula, key = lambda c: (c.course_code or "", c.code))
+		self.years = years # curriculum code -> sorted years
+		self.codes = [c.course_code or "" for c in self.curricula] # sorted, for the prefix lookups
+		self.by_code = {c.code: c for c in self.curricula}
+		self.index = None # of the descriptions, built on demand: only search needs it
+		self.index_lock = Lock()
+
+	def find_code(self, code):
+		'''
+		Returns the curricula of a degree code. If none matches exactly, the
+		 ones of the codes starting with it.
+		'''
+		code = str(code)
+		start = bisect_left(self.codes, code)
+		end = bisect_right(self.codes, code)
+		if end == start:
+			while end < len(self.codes) and self.codes[end].startswith(code):
+				end += 1
+		return self.curricula[start:end]
+
+	def search(self, query, limit = None):
+		'''
+		Returns the curricula with a word of the degree or curriculum
+		 description (or notes) starting with every term of the query.
+		'''
+		with self.index_lock:
+			if self.index is None: self.index = TeachingIndex(self.curricula, describe)
+		return [self.curricula[p] for p in self.index.search(query, limit)]
+
+	def get(self, code):
+		'''
+		Returns the curriculum with this code, None if it doesn't exist.
+		'''
+		return self.by_code.get(code)
+
+	def get_years(self, code):
+		'''
+		Returns the years of a curriculum, empty if its structure is unknown.
+		'''
+		return self.years.get(code, [])
+
+
+def catalog_path():
+	return path.join(cache.directory, CATALOG_FILENAME)
+
+def persistent():
+	'''
+	The catalog is kept on disk only when it comes from the server.
+	'''
+	return cache.mode != cache.MODE_DISABLED and not snapshot.database
+
+def read_catalog():
+	'''
+	Returns the catalog saved by a previous run, None if it is missing or
+	 older than CATALOG_TTL. In offline mode it never expires.
+	'''
+	if not persistent() or cache.mode == cache.MODE_REFRESH: return None
+	filename = catalog_path()
+	try:
+		if cache.mode != cache.MODE_OFFLINE and time() - stat(filename).st_mtime > CATALOG_TTL:
+			return None
+		with open(filename, encoding = 'utf-8') as catalog_file:
+			data = parse_json(catalog_file.read())
+		return Catalog([Curriculum(*values) for values in data['curricula']], data['years'])
+	except (IOError, OSError, ValueError, TypeError, KeyError):
+		return None
+
+def write_catalog(new_catalog):
+	if not persistent() or cache.mode == cache.MODE_OFFLINE: return
+	filename = catalog_path()
+	try:
+		makedirs(path.dirname(filename), exist_ok = True)
+		with open(filename + ".tmp", 'w', encoding = 'utf-8') as catalog_file:
+			catalog_file.write(to_json_bytes({'curricula': [c.__getstate__() for c in new_catalog.curricula], \
+				'years': new_catalog.years}))
+		replace(filename + ".tmp", filename)
+	except (IOError, OSError) as ioe:
+		print("Unable to save the curricula catalog: {}".format(ioe))
+
+def download_structures():
+	'''
+	Returns a dictionary: curriculum code -> sorted years, None if the
+	 structures can't be downloaded (they are only used for validation).
+	'''
+	from downloader import iter_records # avoid a circular import
+	years = {}
+	try:
+		for g in iter_records(RESOURCE_CURRICULA_STRUCTURE): # all the columns, see CurriculumGroup
+			g = CurriculumGroup.from_record(g)
+			if g.year: years.setdefault(g.curriculum, set()).add(g.year)
+	except (DatastoreError, KeyError, ValueError) as e:
+		print("Unable to get the years of the curricula: {}".format(e))
+		return None
+	return {code: sorted(y) for code, y in years.items()}
+
+def download_catalog():
+	'''
+	Returns a new catalog with all the curricula, and whether it is complete:
+	 without the structures the years are unknown.
+	'''
+	from downloader import iter_records, columns # avoid a circular import
+	curricula = [Curriculum.from_record(r) for r in \
+		iter_records(RESOURCE_CURRICULA_AVAILABLE, {}, columns(Curriculum))]
+	years = download_structures()
+	return Catalog(curricula, years or {}), years is not None
+
+def get_catalog():
+	'''
+	Returns the curricula catalog, downloading it if needed.
+	'''
+	global catalog
+	with catalog_lock:
+		if catalog is None:
+			catalog = read_catalog()
+			if catalog is None:
+				catalog, complete = download_catalog()
+				if complete: write_catalog(catalog) # otherwise try again the next time
+		return catalog
+
+def refresh_catalog():
+	'''
+	Download the catalog again. Without the structures, the curricula are
+	 replaced but the years known so far are kept.
+	'''
+	global catalog
+	new_catalog, complete = download_catalog()
+	with catalog_lock:
+		if not complete and catalog is not None: new_catalog.years = catalog.years
+		catalog = new_catalog
+		if complete: write_catalog(catalog)
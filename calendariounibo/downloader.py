@@ -28,164 +28,391 @@ __AUTHOR__ = "Francesco Tosello"
 # Error codes:
 #
 # 0 OK
-# 1 Unable to get a list of lectures (curriculum not found, error fetching the list)
+# 1 Unable to get a list of lectures (curriculum not found, error fetching the list, see DatastoreError)
 # 2 Malformed data
 # 3 Can't export to file
 # 4 User didn't confirm the operation
 ###
 
 
-# Imports
+# Imports (the heavy ones are imported where needed, to start quickly)
 from api_constants import *
 from argparse import ArgumentParser
-from urllib.request import Request, urlopen
-from urllib.error import HTTPError
 from json import loads as parse_json, dumps as to_json_bytes
 from datetime import datetime, timedelta, timezone
 from re import sub
-from ics import Calendar, Event
+from ics_writer import CalendarWriter, serialize_event, serialize_fragment, complete_fragment, timestamps, read_events, \
+	event_uid, event_hash, recurrence_key
+from os import path, remove, replace
+from filecmp import cmp as same_file
+from time import perf_counter
+import cache
+import http_client
+import snapshot
+import rooms
+import profiling
+import catalog
+import fragments
+import scheduler
+from scheduler import DatastoreError
+from search import TeachingIndex
+from records import CurriculumTeaching, Teaching, Lecture, text
 
 # Constants
-NO_LIMIT_VALUE = 10000
+PAGE_SIZE = 1000 # records fetched with a single request
+SHARD_SIZE = 50 # teaching ids in the filter of a single request, at first (see scheduler.batches)
+FETCH_WORKERS = 4 # parallel requests, see also http_client.POOL_SIZE
+
+projection = True # request only the columns listed in the records FIELDS, see columns
+sql_search = True # datastore_search_sql is enabled on the server, see iter_records
 
 DATE_FORMAT = "%d-%m-%y" # format used when parsing dates
-DEFAULT_START_DATE = datetime.today().astimezone().strftime(DATE_FORMAT)
-DEFAULT_END_DATE = (datetime.today().astimezone() + timedelta(3650)).strftime(DATE_FORMAT)
+DEFAULT_DURATION = 3650 # days, approximatively 10 years (aka no end)
 START_DATE_DESCRIPTION = "timetables starting date"
 END_DATE_DESCRIPTION = "timetables end date"
 
 DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
-LECTURE_COURSE_ID = "course"
-LECTURE_START = "from"
-LECTURE_END = "to"
-LECTURE_NOTES = "note"
-LECTURE_LOCATION = "location"
 
 SUBJECT_REGEX = '\([\w\-]*\)' # remove this regex from title
 
 CALENDAR_CREATOR = "Lecture Scraper"
+ENGINE_STREAM = "stream" # see export_calendar
+ENGINE_ICS = "ics"
+TIMEZONE = "Europe/Rome" # of the datastore times, see ics_writer.TIMEZONES
+SERIES_MIN_LECTURES = 3 # fewer lectures are exported one by one, see weekly_series
+SERIES_MAX_GAP = 21 # days, a longer break starts a new series
 DEFAULT_FILENAME = "lectures.ics"
 
 
-def fetch_json(resource, filters = {}, fields = [], limit = 40):
+def default_start_date():
+	'''
+	Returns today, formatted as DATE_FORMAT.
+	'''
+	return datetime.today().strftime(DATE_FORMAT)
+
+def default_end_date():
+	return (datetime.today() + timedelta(DEFAULT_DURATION)).strftime(DATE_FORMAT)
+
+def post_query(url, payload, resource, key):
+	'''
+	Send a query to the datastore, or read its response from the cache.
+	Parameters: the payload (dictionary) is sent as json, resource and key
+	 (see cache.query_key) address the response in the cache.
+	Returns the json result, None if the datastore answered with an error.
+	The request is retried on the transient failures (see scheduler.send).
+	Raises DatastoreError if the datastore can't be reached.
+	Every call is reported to the profiling listeners.
+	'''
+	start = perf_counter()
+	network = 0.0
+	body = cache.load(resource, key)
+	if body is None:
+		if cache.mode == cache.MODE_OFFLINE:
+			raise DatastoreError("The resource {} is not in the cache and you are offline.".format(resource))
+		data = to_json_bytes(payload).encode()
+
+		def request():
+			# the sizes are read in the thread that sent the request, a hedged one runs in another
+			status, headers, body = http_client.post(url, data, tag = resource, timeout = scheduler.timeout)
+			return status, headers, body, http_client.last_transfer.sizes
+
+		sent = perf_counter()
+		status, headers, body, sizes = scheduler.send(request, resource)
+		network = perf_counter() - sent
+		if status != 200:
+			print("Bad response code: {}".format(status))
+			return None
+		fetched = True
+	else:
+		fetched = False
+	decoding = perf_counter()
+	json = parse_json(body)
+	decoding = perf_counter() - decoding
+	if json['success'] is not True:
+		print("An error occurred: {}".format(json['error']['message']))
+		return None
+	if fetched: cache.store(resource, key, body)
+	if profiling.active():
+		profiling.fetch(resource, perf_counter() - start, network, decoding, \
+			sizes[0] if fetched else 0, len(body), \
+			len(json['result'].get('records') or []), not fetched)
+	return json['result']
+
+def columns(record_type):
+	'''
+	Returns the fields to request for a record type, all of them (an empty
+	 list) if the projection is disabled.
+	'''
+	return list(record_type.FIELDS) if projection else []
+
+def fetch_page(resource, filters = {}, fields = [], limit = 40, offset = 0):
 	'''
-	Fetches a json for given resource and parameters.
+	Fetches a single page of a resource for given parameters.
 	Parameters:
 		resource: string
 		filters: dictionary
 		fields: list of strings
-	Returns the json records if positive, an empty list if an error occurred.
-
-	TODO: Maybe a little escaping of the url must be done.
-	TODO: Use filters (maybe)
+		limit, offset: integers, the slice of the records to fetch
+	Returns the json result (with 'records' and 'total'), None if an error occurred.
+	The records are sorted by FIELD_RECORD_ID, or the pages could overlap.
+	The successful responses are kept in the on-disk cache (see cache.py).
 	'''
-	req_payload = {RESOURCE_PARAMETER: resource, LIMIT_PARAMETER: int(limit)}
+	req_payload = {RESOURCE_PARAMETER: resource, LIMIT_PARAMETER: int(limit), SORT_PARAMETER: FIELD_RECORD_ID}
+	if offset: req_payload[OFFSET_PARAMETER] = int(offset)
 	if filters: req_payload[FILTERS_PARAMETER] = filters
 	if fields: req_payload[FIELDS_PARAMETER] = fields
-	r = Request(DATA_QUERY_URL, headers = {'Content-Type': 'application/json'}, \
-		data = to_json_bytes(req_payload).encode())
-	try:
-		with urlopen(r) as response:
-			if response.code is not 200:
-				print("Bad response code: {}".format(response.code))
-				return []
-			json = parse_json(response.read())
-			if json['success'] is not True:
-				print("An error occurred: {}".format(json['error']['message']))
-				return []
-			if 'total' in json['result'] and int(json['result']['total']) > 0:
-				return json['result']['records']
-			else:
-				print("No results found.")
-				exit(1)
-	except HTTPError as httpe:
-		print(httpe)
-		exit(1)
+	return post_query(DATA_QUERY_URL, req_payload, resource, \
+		cache.query_key(resource, filters, fields, limit, offset, sort = FIELD_RECORD_ID))
+
+def sql_literal(value):
+	return "'{}'".format(str(value).replace("'", "''"))
+
+def sql_identifier(name):
+	return '"{}"'.format(str(name).replace('"', '""'))
+
+def build_sql(resource, filters = {}, fields = [], window = None, limit = PAGE_SIZE, offset = 0):
+	'''
+	Translate a query to the SQL dialect of datastore_search_sql.
+	Parameters: window is a tuple (field, lowest, highest) to select the
+	 records with lowest <= field <= highest, None for no bounds.
+	'''
+	conditions = []
+	for field, value in sorted((filters or {}).items()):
+		values = value if isinstance(value, (list, tuple, set)) else [value]
+		conditions.append("{} IN ({})".format(sql_identifier(field), ", ".join(sql_literal(v) for v in values)))
+	if window:
+		field, lowest, highest = window
+		if lowest is not None: conditions.append("{} >= {}".format(sql_identifier(field), sql_literal(lowest)))
+		if highest is not None: conditions.append("{} <= {}".format(sql_identifier(field), sql_literal(highest)))
+	sql = "SELECT {} FROM {}".format(", ".join(sql_identifier(f) for f in fields) if fields else "*", \
+		sql_identifier(resource))
+	if conditions: sql += " WHERE " + " AND ".join(conditions)
+	return sql + " ORDER BY {} LIMIT {:d} OFFSET {:d}".format(sql_identifier(FIELD_RECORD_ID), int(limit), int(offset))
+
+def fetch_sql_page(resource, sql):
+	'''
+	Fetches the records selected by an SQL query (see build_sql).
+	Returns the json result (with 'records'), None if an error occurred.
+	'''
+	return post_query(DATA_SQL_URL, {SQL_PARAMETER: sql}, resource, cache.query_key(resource, sql = sql))
+
+def in_window(record, window):
+	'''
+	Whether a record is inside a window (see build_sql), checked locally.
+	'''
+	field, lowest, highest = window
+	value = record.get(field)
+	return value is not None and (lowest is None or value >= lowest) and (highest is None or value <= highest)
+
+def iter_records(resource, filters = {}, fields = [], page_size = PAGE_SIZE, window = None):
+	'''
+	Generator of all the records of a resource for given parameters.
+	The records are requested with consecutive offsets, page_size at a time,
+	 so only one page is in memory and no dataset gets truncated.
+	The window (see build_sql) is applied by the server with an SQL query.
+	If the server refuses it (not a transient error), from then on the pages
+	 are requested without the window and the records outside are dropped here.
+	It yields nothing if there are no results, or if the first page fails.
+	Raises DatastoreError if a later page fails: the records would be truncated.
+	If a snapshot is open the records are read from it instead.
+	'''
+	global sql_search
+	if snapshot.database:
+		for record in snapshot.query(resource, filters, fields, window):
+			profiling.count_records(1)
+			yield record
+		return
+	use_sql = window and sql_search
+	if window and not use_sql and fields and window[0] not in fields:
+		fields = list(fields) + [window[0]]
+	offset = 0
+	while True:
+		if use_sql:
+			try:
+				result = fetch_sql_page(resource, build_sql(resource, filters, fields, window, page_size, offset))
+			except DatastoreError as e:
+				if e.transient or offset or cache.mode == cache.MODE_OFFLINE: raise # not a disabled endpoint
+				result = None
+			if result is None and not offset: # the endpoint is disabled
+				if sql_search:
+					sql_search = False
+					print("The SQL search is not available, the dates are filtered locally.")
+				yield from iter_records(resource, filters, fields, page_size, window)
+				return
+		else:
+			result = fetch_page(resource, filters, fields, page_size, offset)
+		if result is None:
+			if offset: raise DatastoreError("Unable to read {} past {:d} records.".format(resource, offset))
+			return
+		records = result['records']
+		total = result.get('total') # the sql results have no total
+		del result
+		if not records: return
+		profiling.count_records(len(records))
+		offset += len(records)
+		last_page = len(records) < page_size if total is None else offset >= int(total)
+		if window and not use_sql:
+			records = [r for r in records if in_window(r, window)]
+		records.reverse()
+		while records: # release every record once consumed
+			yield records.pop()
+		if last_page: return
 
 def fetch_curricula(code):
 	'''
-	Fetch the curricula associated with this degree code.
-	Returns a list.
+	Find the curricula associated with this degree code in the catalog (see
+	 catalog.py), or with the codes starting with it if none matches.
+	Returns a list of Curriculum. If none is found then exit with a message.
+	'''
+	curricula = catalog.get_catalog().find_code(code)
+	if not curricula:
+		print("No results found.")
+		exit(1)
+	return curricula
+
+
+def teachings_index(records):
+	'''
+	Returns the index of the names of the curriculum details with an id.
 	'''
-	return fetch_json(RESOURCE_CURRICULA_AVAILABLE, {FIELD_CURRICULUM_COURSE_CODE: str(code)})
+	return TeachingIndex(t for t in records if t.id)
 
+def select_teachings(records, year = 0, teachings = [], inactive = False, index = None):
+	'''
+	Select the teachings of a curriculum for this year and/or the requested
+	 teachings (either component ids or parts of their name).
+	Parameters: records is an iterable over the curriculum details (CurriculumTeaching),
+	 index may be a TeachingIndex of the ones with an id (see teachings_index) to reuse.
+	Returns a list of CurriculumTeaching, empty if nothing matches.
+	'''
+	if not teachings:
+		filtered_list = [t for t in records if t.year == int(year)]
+	else:
+		rows = index.records if index else [t for t in records if t.id]
+		selected = set(i for i, t in enumerate(rows) if t.year == int(year)) # if the year is not specified no course will be added
+		ids = set()
+		names = []
+		for tin in teachings:
+			try:
+				ids.add(int(tin))
+			except ValueError:
+				if type(tin) == str: names.append(tin)
+		selected.update(i for i, t in enumerate(rows) if t.id in ids)
+		if names and index is None: index = teachings_index(rows)
+		for name in names:
+			selected.update(index.match_phrase(name))
+		if not selected: # try with a rougher search, every word of the name in any order
+			for name in names:
+				selected.update(index.match_words(name))
+		filtered_list = [rows[i] for i in sorted(selected)] # keep the curriculum order
+	if not inactive and filtered_list:
+		filtered_list_2 = []
+		for t in filtered_list:
+			if t.active: filtered_list_2.append(t)
+		filtered_list = filtered_list_2
+	return filtered_list
 
 def fetch_teachings(curriculum, year = 0, teachings = [], inactive = False):
 	'''
-	This functions returns a list of teachings (dictionary).
+	This functions returns a list of teachings (CurriculumTeaching).
 	If no teaching is found then exit with a message.
 	'''
 	filters = {FIELD_CURRICULUM_CODE: str(curriculum)}
 	if not teachings and year > 0:
 		filters[FIELD_CURRICULUM_YEAR] = int(year)
-		filtered_list = fetch_json(RESOURCE_CURRICULA_DETAILS, filters)
-	elif teachings:
-		tlist = fetch_json(RESOURCE_CURRICULA_DETAILS, filters, limit = NO_LIMIT_VALUE)
-		filtered_list = []
-		for t in tlist:
-			if not t[FIELD_CURRICULUM_TEACHING_ID]: continue # skip this
-			if int(t[FIELD_CURRICULUM_YEAR]) == int(year): # if the year is not specified no course will be added
-				filtered_list.append(t)
-			else: # do not add it twice
-				for tin in teachings:
-					try:
-						cid = int(tin)
-						if int(t[FIELD_CURRICULUM_TEACHING_ID]) == cid:
-							filtered_list.append(t)
-							break
-					except ValueError:
-						if type(tin) == str and tin.lower() in t[FIELD_CURRICULUM_SUBJECT_DESCRIPTION].lower():
-							filtered_list.append(t)
-							break
-		if not filtered_list: # try with a rougher search
-			for t in tlist:
-				if not t[FIELD_CURRICULUM_TEACHING_ID]: continue # skip this
-				for tin in teachings:
-					if type(tin) is not str: continue # we don't need course ids
-					if all([ \
-						bool( x in t[FIELD_CURRICULUM_SUBJECT_DESCRIPTION].lower() ) for x in tin.lower().split() \
-						]):
-						filtered_list.append(t)
-						break
-	if not inactive and filtered_list:
-		filtered_list_2 = []
-		for t in filtered_list:
-			if t[FIELD_CURRICULUM_ACTIVE]: filtered_list_2.append(t)
-		filtered_list = filtered_list_2
+	filtered_list = select_teachings((CurriculumTeaching.from_record(r) for r in \
+		iter_records(RESOURCE_CURRICULA_DETAILS, filters, columns(CurriculumTeaching))), year, teachings, inactive)
 	if filtered_list:
 		return filtered_list
 	else:
 		print("No teaching has been found with your filters, please check your request.")
 		exit(0) # it is not really an error
 
-def fetch_courses(teachings, fork_regex = None):
+def fetch_teaching_trees(teachings):
+	'''
+	Fetch the details of these teachings and of all their parts.
+	Returns a dictionary: root component id -> list of Teaching.
+	'''
+	def fetch_trees(ids):
+		return [Teaching.from_record(l) for l in \
+			iter_records(RESOURCE_TEACHING_DETAILS, {FIELD_TEACHING_ROOT_ID: ids}, columns(Teaching))]
+
+	ldict = {}
+	for batch in scheduler.batches(fetch_trees, sorted(set(str(t.id) for t in teachings if t.id)), \
+		RESOURCE_TEACHING_DETAILS, SHARD_SIZE, FETCH_WORKERS):
+		for l in batch: # all the parts of a teaching are in the same batch, in order
+			ldict.setdefault(l.root_id, []).append(l)
+	return ldict
+
+def fetch_courses(teachings, fork_regex = None, fork_choices = None):
 	'''
 	Get the list of lectures for these teachings.
 	If the component id is not in the online teachings list then exclude it.
-	Parameters: teaching (list), fork_regex (string).
+	Parameters: teaching (list), fork_regex (string), fork_choices (see resolve_courses).
 	'''
-	lectures = fetch_json(RESOURCE_TEACHING_DETAILS, \
-		{FIELD_TEACHING_ROOT_ID: [\
-			str(t[FIELD_CURRICULUM_TEACHING_ID]) for t in teachings if t[FIELD_CURRICULUM_TEACHING_ID] ]}, \
-			limit = NO_LIMIT_VALUE)
-	ldict = {}
-	for l in lectures: ldict.setdefault(int(l[FIELD_TEACHING_ROOT_ID]), []).append(l)
-	
+	with profiling.stage("fetch_teaching_trees"):
+		ldict = fetch_teaching_trees(teachings)
+	if not ldict:
+		print("No results found.")
+		exit(1)
+	with profiling.stage("resolve_courses"):
+		return resolve_courses(teachings, ldict, fork_regex, fork_choices)
+
+def load_fork_choices(filename):
+	'''
+	Read the saved fork choices, an empty dictionary if there are none.
+	'''
+	try:
+		with open(filename) as forks_file:
+			return {str(k): str(v) for k, v in parse_json(forks_file.read()).items()}
+	except FileNotFoundError:
+		return {}
+	except (IOError, ValueError, AttributeError) as e:
+		print("Unable to read the fork choices: {}".format(e))
+		exit(2)
+
+def save_fork_choices(filename, fork_choices):
+	try:
+		with open(filename, 'w') as forks_file:
+			forks_file.write(to_json_bytes(fork_choices, indent = 1, sort_keys = True))
+	except IOError as ioe:
+		print("Unable to save the fork choices: {}".format(ioe))
+
+def resolve_courses(teachings, ldict, fork_regex = None, fork_choices = None, interactive = True):
+	'''
+	Select the courses to follow for these teachings, given the teaching trees
+	 (as returned by fetch_teaching_trees) and choosing between forks.
+	Parameters: fork_choices is a dictionary (father id -> chosen id, both
+	 strings) with the decisions already taken, the new ones are added to it.
+	 If not interactive the forks that can't be decided are all followed.
+	'''
+	if fork_choices is None: fork_choices = {}
+
 	def choose_fork(teachings):
 		'''
 		Choose between a list of forked teachings.
 		'''
+		father = str(teachings[0].father_id)
+		if father in fork_choices:
+			saved = [t for t in teachings if str(t.id) == str(fork_choices[father])]
+			if saved: return saved[0]
+		fork = select_fork(teachings)
+		if fork: fork_choices[father] = str(fork.id)
+		return fork
+
+	def select_fork(teachings):
 		if fork_regex:
-			valid_teachings = [t for t in teachings if fork_regex in t[FIELD_TEACHING_SUBJECT_DESCRIPTION]]
+			valid_teachings = [t for t in teachings if fork_regex in t.description]
 			if len(valid_teachings) == 1:
 				return valid_teachings[0]
 			else:
 				print("Unable to extract a single match with the regex that you provided.")
+		if not interactive: return None
 		print("Chose a teaching from these:")
 		for i,t in enumerate(teachings):
-			print("{:d}. Description: {}".format(i+1, t[FIELD_TEACHING_SUBJECT_DESCRIPTION]) + \
-				" lectured by {}".format(t[FIELD_TEACHING_TEACHER_NAME]) if t[FIELD_TEACHING_TEACHER_NAME] else "" + \
-				" in {}.".format(t[FIELD_TEACHING_LANGUAGE]) if t[FIELD_TEACHING_LANGUAGE] else ".")
+			print("{:d}. Description: {}".format(i+1, t.description) + \
+				" lectured by {}".format(t.teacher) if t.teacher else "" + \
+				" in {}.".format(t.language) if t.language else ".")
 		num = 0
 		while num < 1 or num > len(teachings):
 			num = int(input("Insert the teaching number: "))
@@ -193,33 +420,63 @@ def fetch_courses(teachings, fork_regex = None):
 
 	def resolve_teachings(code, teachings):
 		'''
-		Recursively select a list of teachings choosing between forks.
+		Select a list of teachings from a tree, choosing between forks.
+		The tree is walked iteratively with the children indexed by father.
 		Returns a list.
 		'''
-		choice_list = [t for t in teachings if t[FIELD_TEACHING_FATHER_ID] and int(t[FIELD_TEACHING_FATHER_ID]) == int(code)]
-		if not choice_list: return [t for t in teachings if int(t[FIELD_TEACHING_ID]) == int(code)] # simple teaching
+		by_id = {}
+		children = {}
+		for t in teachings:
+			by_id.setdefault(t.id, t)
+			if t.father_id: children.setdefault(t.father_id, []).append(t)
 		sel_lectures = []
-		# suppose that this is either a fork or an integrated course
-		if choice_list[0][FIELD_TEACHING_TYPE] == FIELD_TEACHING_TYPE_PART:
-			for t in choice_list: sel_lectures += resolve_teachings(t[FIELD_TEACHING_ID], teachings)
-		elif choice_list[0][FIELD_TEACHING_TYPE] == FIELD_TEACHING_TYPE_FORK:
-			sel_lectures += resolve_teachings(choose_fork(choice_list)[FIELD_TEACHING_ID], teachings)
-		else:
-			print("Unknown teaching type: {}".format(choice_list[0][FIELD_TEACHING_TYPE]))
-			exit(2)
+		visited = set()
+		stack = [int(code)]
+		while stack:
+			code = stack.pop()
+			if code in visited: continue # malformed tree
+			visited.add(code)
+			choice_list = children.get(code)
+			if not choice_list: # simple teaching
+				if code in by_id: sel_lectures.append(by_id[code])
+				continue
+			# suppose that this is either a fork or an integrated course
+			if choice_list[0].type == FIELD_TEACHING_TYPE_PART:
+				stack += reversed([t.id for t in choice_list]) # keep their order
+			elif choice_list[0].type == FIELD_TEACHING_TYPE_FORK:
+				fork = choose_fork(choice_list)
+				stack += [fork.id] if fork else reversed([t.id for t in choice_list])
+			else:
+				print("Unknown teaching type: {}".format(choice_list[0].type))
+				exit(2)
 		return sel_lectures
 
 	lectures = []
-	for code in ldict: # cycle through courses
-		lectures += resolve_teachings(code, ldict[code])
+	for code in dict.fromkeys(t.id for t in teachings if t.id):
+		if code in ldict: # cycle through courses
+			lectures += resolve_teachings(code, ldict[code])
 	return lectures
 
-def retrieve_timetables(courses, start = DEFAULT_START_DATE, end = DEFAULT_END_DATE, coordinates = False):
+def parse_timestamps(values):
+	'''
+	Parse many timestamps (formatted as DATETIME_FORMAT) at once, every
+	 distinct value only one time: the lectures share few start and end times.
+	Returns a dictionary: string -> aware datetime.
+	'''
+	parsed = {}
+	for value in values:
+		if value not in parsed: parsed[value] = datetime.fromisoformat(value).astimezone()
+	return parsed
+
+def retrieve_timetables(courses, start = None, end = None, coordinates = False):
 	'''
 	Given the courses retrieve the timetable.
-	Returns a dictionary in which the keys are the course ids and the value a list
-	 of structured data for the timetables.
+	Parameters: start and end dates formatted as DATE_FORMAT, by default
+	 today and DEFAULT_DURATION days from today.
+	Returns a list of Lecture, sorted by start, empty if there are none.
 	'''
+	from concurrent.futures import ThreadPoolExecutor
+
 	def parse_date(date_string, description):
 		'''
 		Get a date from a string, asking for a new if badly formatted.
@@ -235,92 +492,299 @@ def retrieve_timetables(courses, start = DEFAULT_START_DATE, end = DEFAULT_END_D
 				date_string = input("Please, insert the {} in this format: dd-mm-yy. Date: ".format(description))
 		return date
 
-	start_date = parse_date(start, START_DATE_DESCRIPTION)
-	end_date = parse_date(end, END_DATE_DESCRIPTION)
-	timetables = fetch_json(RESOURCE_TIMETABLES, \
-		{FIELD_TIMETABLE_TEACHING_ID: [str(c[FIELD_TEACHING_ID]) for c in courses] }, \
-		limit = NO_LIMIT_VALUE)
-	room_codes = set([t[FIELD_TIMETABLE_ROOM_ID] for t in timetables if t[FIELD_TIMETABLE_ROOM_ID]])
-	roomslist = [z for r in room_codes for z in r.split()]
-	## Here comes a workaround for Briefcase that doesn't understands multiple list comprehension:
-	#roomslist = []
-	#for r in room_codes:
-	#	roomslist += r.split()
-	##
-	rooms = fetch_json(RESOURCE_ROOMS, {FIELD_ROOMS_ROOM_ID: roomslist}, \
-		limit = len(room_codes))
-	classrooms = {}
-	for r in rooms: classrooms.setdefault(r[FIELD_ROOMS_ROOM_ID], r)
-	
-	def build_location(classroom_ids):
+	start_date = parse_date(start or default_start_date(), START_DATE_DESCRIPTION)
+	end_date = parse_date(end or default_end_date(), END_DATE_DESCRIPTION)
+	window = (FIELD_TIMETABLE_START, start_date.strftime(DATETIME_FORMAT), end_date.strftime(DATETIME_FORMAT))
+	timestamps = {}
+
+	def fetch_timetables(ids):
 		'''
-		Make a string representing the location of the classroom(s).
+		Fetch the lectures of a shard of courses inside the dates range,
+		 the range is applied by the server.
+		Returns the lectures, as tuples (course id, start, end, notes, rooms),
+		 and their parsed timestamps.
 		'''
-		ids = classroom_ids.split()
-		location = ""
-		for idx, cl_id in enumerate(ids):
-			if idx > 0: # not the first item
-				location += " OPPURE "
-			classroom = classrooms[cl_id]
-			location += classroom[FIELD_ROOMS_NAME].title()
-			if coordinates:
-				if classroom[FIELD_ROOMS_LATITUDE]: # assume both coordinates null toghether
-					location += (" - {} {}".format(\
-						classroom[FIELD_ROOMS_LATITUDE], classroom[FIELD_ROOMS_LONGITUDE]))
-			elif classroom[FIELD_ROOMS_FLOOR] or classroom[FIELD_ROOMS_ADDRESS]:
-				location += " -"
-				if classroom[FIELD_ROOMS_FLOOR]: location += " {}".format(classroom[FIELD_ROOMS_FLOOR])
-				if classroom[FIELD_ROOMS_ADDRESS]:
-					location += " in {}".format(classroom[FIELD_ROOMS_ADDRESS].replace(', ', ' '))
-		return location
+		lectures = [(int(t[FIELD_TIMETABLE_TEACHING_ID]), text(t[FIELD_TIMETABLE_START]), text(t[FIELD_TIMETABLE_END]), \
+			text(t[FIELD_TIMETABLE_NOTES]), text(t[FIELD_TIMETABLE_ROOM_ID] or "")) \
+			for t in iter_records(RESOURCE_TIMETABLES, {FIELD_TIMETABLE_TEACHING_ID: ids}, columns(Lecture), window = window)]
+		return lectures, parse_timestamps(t[i] for t in lectures for i in (1, 2))
 
 	def build_record(lecture):
 		'''
 		Builds a record that will be exported to the calendar starting from a lecture.
+		The locations are memoized by rooms.build_location.
 		'''
-		return {LECTURE_COURSE_ID: int(lecture[FIELD_TIMETABLE_TEACHING_ID]), \
-					LECTURE_START: datetime.strptime(str(lecture[FIELD_TIMETABLE_START]), DATETIME_FORMAT).astimezone(), \
-					LECTURE_END: datetime.strptime(str(lecture[FIELD_TIMETABLE_END]), DATETIME_FORMAT).astimezone(), \
-					LECTURE_NOTES: str(lecture[FIELD_TIMETABLE_NOTES]), \
-					LECTURE_LOCATION: build_location(lecture[FIELD_TIMETABLE_ROOM_ID]), \
-					}
-
-	records = []
-	for lecture in timetables:
-		lec = build_record(lecture)
-		if start_date <= lec[LECTURE_START] <= end_date:
-			records.append(lec)
+		course_id, start, end, notes, room_ids = lecture
+		return Lecture(course_id, timestamps[start], timestamps[end], notes, \
+			rooms.build_location(room_ids, coordinates), room_ids)
+
+	# The timetables are fetched in parallel shards, while the rooms directory
+	# is loaded (or downloaded, once a day).
+	ids = sorted(set(str(c.id) for c in courses))
+	lectures = []
+	with profiling.stage("fetch_timetables"), ThreadPoolExecutor(1) as executor:
+		directory_future = executor.submit(rooms.get_directory)
+		for shard_lectures, shard_timestamps in scheduler.batches(fetch_timetables, ids, RESOURCE_TIMETABLES, \
+			SHARD_SIZE, FETCH_WORKERS):
+			timestamps.update(shard_timestamps)
+			lectures += shard_lectures
+		directory_future.result()
+	with profiling.stage("build_records"):
+		rooms.find_rooms(set(z for t in lectures for z in t[4].split())) # rooms added after the last refresh
+		records = [build_record(t) for t in lectures]
+		del lectures
+		records.sort(key = lambda r: (r.start, r.course_id))
 	return records
 
-def export_calendar(courses, timetables, filename):
-	c = Calendar(creator = CALENDAR_CREATOR)
+def event_properties(course, lecture):
+	'''
+	Returns the texts of the calendar event of a lecture:
+	 a tuple (name, description, location, url), the missing ones are None.
+	'''
+	name = sub(SUBJECT_REGEX, '', course.description.capitalize())
+	description = None
+	if course.teacher:
+		description = "Tenuto da {}".format(course.teacher.title())
+	return name, description, lecture.location or None, course.url or None
+
+def lecture_uid(lecture):
+	'''
+	Returns a stable UID for the event of a lecture.
+	'''
+	return event_uid(lecture.course_id, lecture.start.strftime(DATETIME_FORMAT), lecture.rooms)
+
+def find_course(course_index, lecture):
+	'''
+	Returns the course of a lecture, given the courses indexed by id.
+	'''
+	try:
+		return course_index[lecture.course_id]
+	except KeyError as ke:
+		print("Something gone wrong, I can't find the course with this id: {}".format(lecture.course_id))
+		exit(2)
+
+def wall_time(date):
+	'''
+	Returns the datastore time of a lecture, naive: the timestamps are parsed
+	 in the local timezone (see parse_timestamps), their fields are untouched.
+	'''
+	return date.replace(tzinfo = None)
+
+def weekly_series(timetables):
+	'''
+	Group the lectures of the same course, weekday, time, duration and
+	 location into weekly series, so that each one is exported as a single
+	 recurring event. A series ends at a break longer than SERIES_MAX_GAP
+	 days, the shorter ones (holidays) are its exceptions. The series of less
+	 than SERIES_MIN_LECTURES lectures are split again, and their lectures
+	 join a series of the same course, time and location in another weekday
+	 (as extra dates) if its span covers them.
+	Returns a list of tuples (lectures, weeks, exdates, rdates) sorted by
+	 start: the first lecture gives the event, weeks is the number of weeks
+	 spanned (None for a single lecture), exdates are the skipped weeks and
+	 rdates the extra dates, as wall times.
+	'''
+	groups = {}
+	for lecture in timetables:
+		key = (lecture.course_id, lecture.start.weekday(), wall_time(lecture.start).time(), \
+			lecture.end - lecture.start, lecture.location, lecture.rooms)
+		groups.setdefault(key, {}).setdefault(lecture.start, lecture) # the duplicates are dropped
+	series = []
+	singles = []
+	for lectures in groups.values():
+		lectures = [lectures[start] for start in sorted(lectures)]
+		run = lectures[:1]
+		for lecture in lectures[1:] + [None]:
+			if lecture and (lecture.start.date() - run[-1].start.date()).days <= SERIES_MAX_GAP:
+				run.append(lecture)
+				continue
+			if len(run) < SERIES_MIN_LECTURES: singles += run
+			else: series.append((run, []))
+			run = [lecture]
+	index = {} # (course, time, duration, location, rooms) -> series
+	for run, extra in series:
+		first = run[0]
+		index.setdefault((first.course_id, wall_time(first.start).time(), first.end - first.start, \
+			first.location, first.rooms), []).append((run, extra))
+	items = []
+	for lecture in singles:
+		candidates = index.get((lecture.course_id, wall_time(lecture.start).time(), lecture.end - lecture.start, \
+			lecture.location, lecture.rooms), [])
+		for run, extra in candidates:
+			if run[0].start < lecture.start < run[-1].start:
+				extra.append(lecture)
+				break
+		else:
+			items.append(([lecture], None, [], []))
+	for run, extra in series:
+		start = wall_time(run[0].start)
+		weeks = (run[-1].start.date() - run[0].start.date()).days // 7 + 1
+		dates = set(wall_time(l.start) for l in run)
+		exdates = [d for d in (start + timedelta(7 * w) for w in range(weeks)) if d not in dates]
+		items.append((run, weeks, exdates, [wall_time(l.start) for l in extra]))
+	items.sort(key = lambda i: (i[0][0].start, i[0][0].course_id))
+	return items
+
+def semester(date):
+	'''
+	Returns the academic semester of a date: a tuple (first year of the
+	 academic year, 1 from August to January or 2 from February to July).
+	'''
+	if date.month >= 8: return date.year, 1
+	if date.month == 1: return date.year - 1, 1
+	return date.year - 1, 2
+
+def series_key(lectures):
+	'''
+	Returns what identifies a weekly series (see weekly_series): its course,
+	 weekday, time, duration and rooms, and the semester of its last lecture.
+	The first lecture is not part of it, since it changes while the start
+	 date of the export moves forward.
+	'''
+	first = lectures[0]
+	return (first.course_id, first.start.weekday(), wall_time(first.start).strftime("%H:%M"), \
+		int((first.end - first.start).total_seconds()) // 60, first.rooms, "{}-{}".format(*semester(lectures[-1].start)))
+
+def series_uid(lectures, ordinal = 0):
+	'''
+	Returns a stable UID for the recurring event of a series, distinct from
+	 the ones of the lectures alone. The ordinal tells apart the series with
+	 the same key, counting from the last one.
+	'''
+	return event_uid("weekly", *series_key(lectures), *([ordinal] if ordinal else []))
+
+def calendar_events(timetables, weekly = False):
+	'''
+	Returns an iterable over the events of the lectures, as tuples
+	 (uid, lecture, recurrence): the lecture gives the event, recurrence are
+	 the serialize_event options. See stream_events for weekly.
+	'''
+	if weekly: items = weekly_series(timetables)
+	else: items = [([lecture], None, [], []) for lecture in timetables]
+	tzid = TIMEZONE if weekly else None
+	ordinals = {} # series key -> series seen, from the last one
+	uids = []
+	for lectures, weeks, exdates, rdates in reversed(items):
+		if not weeks:
+			uids.append(lecture_uid(lectures[0]))
+			continue
+		key = series_key(lectures)
+		ordinals[key] = ordinals.get(key, -1) + 1
+		uids.append(series_uid(lectures, ordinals[key]))
+	for (lectures, weeks, exdates, rdates), uid in zip(items, reversed(uids)):
+		yield uid, lectures[0], {'tzid': tzid, 'count': weeks, 'exdates': exdates, 'rdates': rdates}
+
+def event_fragment(course, uid, lecture, recurrence):
+	'''
+	Returns the rendered event of a lecture without its timestamps (see
+	 ics_writer.serialize_fragment), from the shared fragments cache if the
+	 same lecture has already been rendered for another calendar.
+	'''
+	key = fragments.content_key(uid, lecture.start, lecture.end, lecture.location, course.description, \
+		course.teacher, course.url, *recurrence.values())
+	fragment = fragments.fragment_cache.get(key)
+	if fragment is None:
+		fragment = serialize_fragment(uid, lecture.start, lecture.end, *event_properties(course, lecture), \
+			**recurrence)
+		fragments.fragment_cache.put(key, fragment)
+	return fragment
+
+def render_fragments(course_index, timetables, weekly = False):
+	'''
+	Fill the fragments cache with the events of these lectures, so that the
+	 calendars built afterwards only concatenate them.
+	'''
+	for uid, lecture, recurrence in calendar_events(timetables, weekly):
+		event_fragment(find_course(course_index, lecture), uid, lecture, recurrence)
+
+def stream_events(calendar, course_index, timetables, previous = {}, created = None, weekly = False):
+	'''
+	Write the events of the lectures to a CalendarWriter, copying verbatim the
+	 previous ones (as returned by ics_writer.read_events) that didn't change.
+	The new events are made of the shared fragments, see event_fragment.
+	With weekly the regular lectures are collapsed into recurring events
+	 (see weekly_series) and every time is written in the TIMEZONE, so the
+	 series don't shift with the daylight saving time: the writer must
+	 include it.
+	The previous events that are written are removed from the dictionary.
+	Returns a tuple with the number of (added, changed, removed) events.
+	'''
+	if created is None: created = datetime.today().astimezone()
+	new_timestamps = timestamps(created)
+	added = changed = 0
+	written = set()
+	for uid, lecture, recurrence in calendar_events(timetables, weekly):
+		if uid in written: continue # duplicated lecture
+		written.add(uid)
+		course = find_course(course_index, lecture)
+		old = previous.pop(uid, None)
+		if not old:
+			added += 1
+			calendar.write(complete_fragment(event_fragment(course, uid, lecture, recurrence), new_timestamps))
+			continue
+		properties = event_properties(course, lecture)
+		if old.hash == event_hash(lecture.start, lecture.end, *properties, *recurrence_key(**recurrence)):
+			calendar.write(old.block)
+			continue
+		changed += 1
+		calendar.write(serialize_event(uid, lecture.start, lecture.end, old.created, \
+			*properties, stamp = created, sequence = old.sequence + 1, **recurrence))
+	return added, changed, len(previous)
+
+def export_calendar(courses, timetables, filename, engine = ENGINE_STREAM, incremental = False, weekly = False):
+	'''
+	Export the lectures to an ics file.
+	The stream engine serializes the events straight to the file, the ics
+	 engine builds the whole calendar with the ics library first.
+	With weekly (stream engine only) the regular lectures become recurring
+	 events, see stream_events.
+	In incremental mode (stream engine only) the previous export is read back:
+	 the unchanged events are copied verbatim and if nothing changed at all
+	 the file is left untouched.
+	Returns a tuple with the number of (added, changed, removed) events.
+	'''
+	course_index = {x.id: x for x in courses}
+	created = datetime.today().astimezone()
 
 	def create_lecture_event(lecture):
 		'''
 		Create the calendar event given the lecture.
 		'''
-		try:
-			course = [x for x in courses if int(x[FIELD_TEACHING_ID]) == \
-				lecture[LECTURE_COURSE_ID]][0] # assume there is only one
-		except IndexError as ie:
-			print("Something gone wrong, I can't find the course with this id: {}".format(lecture[LECTURE_COURSE_ID]))
-			exit(2)
+		from ics import Event
+		name, description, location, url = event_properties(find_course(course_index, lecture), lecture)
 		e = Event()
-		e.name = sub(SUBJECT_REGEX, '', course[FIELD_TEACHING_SUBJECT_DESCRIPTION].capitalize())
-		if course[FIELD_TEACHING_TEACHER_NAME]:
-			e.description = "Tenuto da {}".format(course[FIELD_TEACHING_TEACHER_NAME].title())
-		e.begin = lecture[LECTURE_START]
-		e.end = lecture[LECTURE_END]
-		e.created = datetime.today().astimezone()
-		if lecture[LECTURE_LOCATION]: e.location = lecture[LECTURE_LOCATION]
-		if course[FIELD_TEACHING_URL]: e.url = course[FIELD_TEACHING_URL]
+		e.uid = lecture_uid(lecture)
+		e.name = name
+		if description: e.description = description
+		e.begin = lecture.start
+		e.end = lecture.end
+		e.created = created
+		if location: e.location = location
+		if url: e.url = url
 		return e
 
-	for lecture in timetables:
-		c.events.add(create_lecture_event(lecture))
 	try:
-		with open(filename, 'w') as ics_file:
-			ics_file.writelines(c)
+		if engine == ENGINE_ICS:
+			from ics import Calendar # slow to import, with its dependencies
+			c = Calendar(creator = CALENDAR_CREATOR)
+			for lecture in timetables:
+				c.events.add(create_lecture_event(lecture))
+			with open(filename, 'w') as ics_file:
+				ics_file.writelines(c)
+			return len(c.events), 0, 0
+		previous = {}
+		if incremental and path.exists(filename):
+			with open(filename, encoding = 'utf-8', newline = '') as ics_file:
+				previous = read_events(ics_file)
+		temp_filename = filename + ".tmp"
+		with open(temp_filename, 'w', encoding = 'utf-8', newline = '') as ics_file, \
+			CalendarWriter(ics_file, CALENDAR_CREATOR, [TIMEZONE] if weekly else []) as calendar:
+			stats = stream_events(calendar, course_index, timetables, previous, created, weekly)
+		if incremental and path.exists(filename) and same_file(temp_filename, filename, shallow = False):
+			remove(temp_filename) # keep the old file, with its modification time
+		else:
+			replace(temp_filename, filename)
+		return stats
 	except IOError as ioe:
 		print("Unable to export the calendar to file: {}".format(ioe))
 		exit(3)
@@ -336,24 +800,91 @@ def ask_for_confirmation(description = ""):
 			exit(4)
 
 def main(curriculum, year = 0, teachings = [], fork_regex = None, inactive = False, \
-	start = DEFAULT_START_DATE, end = DEFAULT_END_DATE, filename = DEFAULT_FILENAME, coordinates = False):
-	teachings = fetch_teachings(curriculum, year, teachings, inactive)
+	start = None, end = None, filename = DEFAULT_FILENAME, coordinates = False, \
+	engine = ENGINE_STREAM, incremental = False, forks = None, profile = None, weekly = False):
+	if profile and not profiling.enabled: profiling.enable() # parse_args enables it earlier
+	try:
+		export(curriculum, year, teachings, fork_regex, inactive, start, end, filename, coordinates, engine, \
+			incremental, forks, weekly)
+	except DatastoreError as e:
+		print(e)
+		exit(1)
+	finally:
+		if profile: profiling.write_report(profile)
+
+def export(curriculum, year, teachings, fork_regex, inactive, start, end, filename, coordinates, engine, \
+	incremental, forks, weekly):
+	'''
+	The whole pipeline, see main.
+	'''
+	fork_choices = load_fork_choices(forks) if forks else None
+	with profiling.stage("fetch_teachings"):
+		teachings = fetch_teachings(curriculum, year, teachings, inactive)
 	if verbose or not quiet:
 		print("I found {:d} teaching(s):".format(len(teachings)))
 		for t in teachings: print(t)
 	ask_for_confirmation("Do you confirm the teachings list? (Y/n)  ")
-	courses = fetch_courses(teachings, fork_regex)
+	with profiling.stage("fetch_courses"):
+		courses = fetch_courses(teachings, fork_regex, fork_choices)
+	if forks: save_fork_choices(forks, fork_choices)
 	if verbose or not quiet:
 		print("So this is the list of your course(s) ({:d}):".format(len(courses)))
 		for c in courses: print(c)
 	ask_for_confirmation("Do you confirm the courses? (Y/n)  ")
-	timetables = retrieve_timetables(courses, start, end, coordinates)
+	with profiling.stage("retrieve_timetables"):
+		timetables = retrieve_timetables(courses, start, end, coordinates)
+	if not timetables:
+		print("No lectures found in the selected dates.")
+		exit(1)
 	if verbose or not quiet:
 		print("I got {:d} lessons.".format(len(timetables)))
 	ask_for_confirmation("Should I proceed and export the lessons? (Y/n)  ")
-	export_calendar(courses, timetables, filename)
+	with profiling.stage("export_calendar"):
+		added, changed, removed = export_calendar(courses, timetables, filename, engine, incremental, weekly)
+	if verbose:
+		print("{:d} new, {:d} changed and {:d} removed event(s).".format(added, changed, removed))
+		print_transfers()
 	print("Done, exported to {}.".format(filename))
 
+def print_transfers():
+	'''
+	Print how many bytes every resource took, on the wire and decoded.
+	'''
+	for resource, (requests, wire_size, size) in sorted(http_client.statistics.items(), key = lambda s: str(s[0])):
+		print("{}: {:d} request(s), {:.1f} kB transferred ({:.1f} kB decoded, {:.0%} saved).".format(resource, \
+			requests, wire_size / 1000, size / 1000, 1 - wire_size / size if size else 0))
+
+def add_source_arguments(parser):
+	'''
+	Add the options about where the data comes from (the on-disk cache or
+	 a local snapshot) to an argument parser. See configure_source.
+	'''
+	cache_group = parser.add_mutually_exclusive_group()
+	cache_group.add_argument('--refresh', action = 'store_const', dest = 'cache_mode', const = cache.MODE_REFRESH, \
+		help = "Ignore the cached data and download everything again.")
+	cache_group.add_argument('--offline', action = 'store_const', dest = 'cache_mode', const = cache.MODE_OFFLINE, \
+		help = "Use only the cached data, even if expired.")
+	cache_group.add_argument('--no-cache', action = 'store_const', dest = 'cache_mode', const = cache.MODE_DISABLED, \
+		help = "Do not read nor write the cache.")
+	parser.add_argument('--cache-dir', help = "Store the cached data in this directory.")
+	parser.add_argument('--snapshot', nargs = '?', const = snapshot.DEFAULT_SNAPSHOT, \
+		help = "Read all the data from a local snapshot (see snapshot.py) instead of the server.")
+	parser.add_argument('--all-fields', action = 'store_true', \
+		help = "Download all the columns of the datasets, not only the used ones.")
+	parser.add_argument('--retries', type = int, default = scheduler.RETRIES, \
+		help = "Attempts after a failed request. Default 4.")
+	parser.add_argument('--timeout', type = float, default = scheduler.REQUEST_TIMEOUT, \
+		help = "Seconds to wait for the datastore before retrying. Default 30.")
+	parser.add_argument('--hedge', action = 'store_true', \
+		help = "Send again the requests slower than usual, the first answer wins.")
+
+def configure_source(args):
+	global projection
+	projection = not args.all_fields
+	scheduler.configure(args.retries, args.timeout, args.hedge)
+	cache.configure(args.cache_mode, args.cache_dir)
+	if args.snapshot: snapshot.open_snapshot(args.snapshot)
+
 def parse_args():
 	parser = ArgumentParser(description = "Export your lectures in a calendar.", epilog = "written by " + __AUTHOR__)
 	curricula_group = parser.add_mutually_exclusive_group(required = True)
@@ -367,40 +898,64 @@ def parse_args():
 	parser.add_argument('--inactive', '--include-inactive', dest = 'inactive', action = 'store_true', \
 		help = "Search also for inactive teachings.")
 	parser.add_argument('-fr', '--fork-regex', dest = 'fregex', help = "Match this string when choosing between forked teachings.")
-	parser.add_argument('--from', '--from-date', dest = 'from_date', default = DEFAULT_START_DATE, \
+	parser.add_argument('--forks', help = "Remember the choices between forked teachings in this file, \
+		and replay them in the next runs.")
+	parser.add_argument('--from', '--from-date', dest = 'from_date', \
 		help = "Start date, format dd-mm-yy. Default today.")
-	parser.add_argument('--to', '--to-date', default = DEFAULT_END_DATE, \
+	parser.add_argument('--to', '--to-date', \
 		help = "End date, format dd-mm-yy. Default approximatively 10 years (aka no end).")
 	parser.add_argument('--coordinates', action = 'store_true', help = "Instead of the address store the gps coordinates of the classroom.")
+	parser.add_argument('--engine', choices = [ENGINE_STREAM, ENGINE_ICS], default = ENGINE_STREAM, \
+		help = "How to write the calendar: streaming the events (default) or with the ics library.")
+	parser.add_argument('-i', '--incremental', action = 'store_true', \
+		help = "Update the previous calendar in the same file, rewriting only the lectures that changed.")
+	parser.add_argument('-W', '--weekly', action = 'store_true', \
+		help = "Export the lectures repeating every week as recurring events, for smaller files (stream engine only).")
+	parser.add_argument('--profile', metavar = 'FILE', \
+		help = "Write a json report of the time, bytes, records and memory of every stage to this file.")
 	parser.add_argument('-v', '--verbose', action = 'store_true', help = "Print more information.")
 	parser.add_argument('-q', '--quiet', action = 'store_true', help = "Do not ask for confirmation of operations.")
+	add_source_arguments(parser)
 	args = parser.parse_args()
 
 	global verbose, quiet
 	verbose = args.verbose
 	quiet = args.quiet
+	configure_source(args)
+	if args.profile: profiling.enable() # the catalog may be downloaded to resolve the code
 
 	if not args.curriculum: # inserted the course's code
-		curricula = fetch_curricula(args.code)
+		try:
+			with profiling.stage("fetch_curricula"):
+				curricula = fetch_curricula(args.code)
+		except DatastoreError as e:
+			print(e)
+			exit(1)
 		if not curricula: exit(1)
 		if len(curricula) > 1:
 			print("Choose a curriculum from these:")
+			many_courses = len(set(curr.course_code for curr in curricula)) > 1 # the code was a prefix
 			for i,curr in enumerate(curricula):
-				print("{:d}. Code: '{}'. Description: {}.{}".format(i+1, curr[FIELD_CURRICULUM_CODE], \
-					curr[FIELD_CURRICULUM_DESCRIPTION], \
-					" Notes: " + curr[FIELD_CURRICULUM_NOTES] + "." if curr[FIELD_CURRICULUM_NOTES] else ''))
+				print("{:d}. {}Code: '{}'. Description: {}.{}".format(i+1, \
+					"{} ({}). ".format(curr.course_description, curr.course_code) if many_courses else '', \
+					curr.code, curr.description, " Notes: " + curr.notes + "." if curr.notes else ''))
 			num = 0
 			while num < 1 or num > len(curricula):
 				num = int(input("Insert the curriculum number: "))
-			args.curriculum = curricula[num-1][FIELD_CURRICULUM_CODE]
-		else: args.curriculum = curricula[0][FIELD_CURRICULUM_CODE]
+			args.curriculum = curricula[num-1].code
+		else: args.curriculum = curricula[0].code
+		years = catalog.get_catalog().get_years(args.curriculum)
+		if args.year and years and args.year not in years:
+			print("The curriculum has no year {:d}, choose one of: {}.".format(args.year, ", ".join(str(y) for y in years)))
+			exit(1)
 
 	if not args.year and not args.teachings:
 		print("Please, select an accademic year or at least a single teaching.")
 		exit(1)
 
 	return args.curriculum, args.year, args.teachings, args.fregex, args.inactive, \
-		args.from_date, args.to, args.file, args.coordinates
+		args.from_date, args.to, args.file, args.coordinates, args.engine, args.incremental, args.forks, \
+		args.profile, args.weekly
 
 if __name__ == '__main__':
 	main(*parse_args())
@@ -0,0 +1,100 @@
+###
+# File: fragments.py
+#
+# Description: A cache of the rendered events, shared by all the calendars
+#                built in the same process: the same lecture is in the
+#                calendars of many students, so it is serialized only once.
+#                The fragments (see ics_writer.serialize_fragment) are keyed
+#                by a hash of the lecture contents, the memory is bounded and
+#                they may be saved to disk for the next runs.
+#
+# Author: Francesco Tosello
+###
+
+from collections import OrderedDict
+from hashlib import sha1
+from json import loads as parse_json, dumps as to_json_bytes
+from os import path, makedirs, replace
+from threading import Lock
+
+# Constants
+MAX_SIZE = 64 * 2**20 # characters of the fragments kept in memory
+FRAGMENTS_FILENAME = "fragments.cache" # in the cache directory, see batch.py --fragments
+FORMAT_VERSION = 1 # of the fragments, increase it when ics_writer.serialize_fragment changes its output
+
+
+def content_key(*values):
+	'''
+	Returns the key of a fragment: a digest of everything it is rendered from,
+	 and of the format, so that the saved fragments of an older version are
+	 never used.
+	'''
+	return sha1(repr((FORMAT_VERSION,) + values).encode()).hexdigest()
+
+
+class FragmentCache():
+	'''
+	A thread safe LRU dictionary of fragments, bounded to max_size characters.
+	'''
+	def __init__(self, max_size = MAX_SIZE):
+		self.max_size = max_size
+		self.size = 0
+		self.fragments = OrderedDict()
+		self.lock = Lock()
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, key):
+		'''
+		Returns the fragment of this key, None if it's missing.
+		'''
+		with self.lock:
+			fragment = self.fragments.get(key)
+			if fragment is None:
+				self.misses += 1
+			else:
+				self.hits += 1
+				self.fragments.move_to_end(key)
+			return fragment
+
+	def put(self, key, fragment):
+		with self.lock:
+			old = self.fragments.pop(key, None)
+			if old: self.size -= len(old[0]) + len(old[1])
+			self.fragments[key] = fragment
+			self.size += len(fragment[0]) + len(fragment[1])
+			while self.size > self.max_size and self.fragments:
+				head, tail = self.fragments.popitem(last = False)[1]
+				self.size -= len(head) + len(tail)
+
+	def clear(self):
+		with self.lock:
+			self.fragments.clear()
+			self.size = 0
+			self.hits = self.misses = 0
+
+	def load(self, filename):
+		'''
+		Add the fragments saved by save, if the file exists.
+		'''
+		try:
+			with open(filename, encoding = 'utf-8') as fragments_file:
+				saved = parse_json(fragments_file.read())
+		except (IOError, OSError, ValueError):
+			return
+		for key, fragment in saved:
+			self.put(key, tuple(fragment))
+
+	def save(self, filename):
+		with self.lock:
+			fragments = list(self.fragments.items()) # the least recently used first
+		try:
+			makedirs(path.dirname(path.abspath(filename)), exist_ok = True)
+			with open(filename + ".tmp", 'w', encoding = 'utf-8') as fragments_file:
+				fragments_file.write(to_json_bytes(fragments))
+			replace(filename + ".tmp", filename)
+		except (IOError, OSError) as ioe:
+			print("Unable to save the events cache: {}".format(ioe))
+
+
+fragment_cache = FragmentCache() # shared by the calendars of the process
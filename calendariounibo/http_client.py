@@ -0,0 +1,139 @@
+###
+# File: http_client.py
+#
+# Description: A minimal HTTP client shared by all the datastore calls.
+#                It keeps a pool of persistent (keep-alive) connections for
+#                every host, so only the first request pays the TCP and TLS
+#                handshakes, and asks for gzip compressed responses.
+#                The transferred bytes are counted, see statistics.
+#
+# Author: Francesco Tosello
+###
+
+from urllib.parse import urlsplit
+from queue import LifoQueue, Full, Empty
+from threading import Lock, local
+
+# Constants
+POOL_SIZE = 8 # idle connections kept open for every host
+TIMEOUT = 60 # seconds
+USER_AGENT = "calendariounibo"
+
+pools = {}
+pools_lock = Lock()
+statistics = {} # tag -> [requests, bytes on the wire, decoded bytes]
+statistics_lock = Lock()
+last_transfer = local() # sizes (bytes on the wire, decoded bytes) of the last response of every thread
+
+
+class ConnectionPool():
+	'''
+	A thread safe pool of keep-alive connections to the same host.
+	When all the connections are busy a new one is opened, and it is kept
+	 only if there's room for it when it is given back.
+	'''
+	def __init__(self, scheme, host, port = None, size = POOL_SIZE, timeout = TIMEOUT):
+		from http.client import HTTPConnection, HTTPSConnection # slow to import, only when needed
+		self.connection_class = HTTPSConnection if scheme == 'https' else HTTPConnection
+		self.host = host
+		self.port = port
+		self.timeout = timeout
+		self.idle = LifoQueue(size) # reuse the most recent connection, the least likely to be closed
+
+	def acquire(self):
+		try:
+			return self.idle.get_nowait(), True
+		except Empty:
+			return self.connection_class(self.host, self.port, timeout = self.timeout), False
+
+	def release(self, connection):
+		try:
+			self.idle.put_nowait(connection)
+		except Full:
+			connection.close()
+
+	def request(self, method, path, body = None, headers = {}, tag = None, timeout = None):
+		'''
+		Send a request and read the whole response.
+		The timeout (seconds) replaces the one of the pool for this request.
+		Returns a tuple (status, headers, body). The body is already decompressed.
+		A reused connection may have been closed by the server in the meantime:
+		 in that case the request is sent again on a brand new connection.
+		The sizes of the response are added to the statistics of the tag.
+		'''
+		from http.client import HTTPException
+		headers = dict(headers)
+		headers.setdefault('Accept-Encoding', 'gzip')
+		headers.setdefault('User-Agent', USER_AGENT)
+		while True:
+			connection, reused = self.acquire()
+			connection.timeout = timeout or self.timeout
+			if connection.sock: connection.sock.settimeout(connection.timeout)
+			try:
+				connection.request(method, path, body = body, headers = headers)
+				response = connection.getresponse()
+				data = response.read()
+			except (HTTPException, ConnectionError) as e:
+				connection.close()
+				if reused: continue # stale connection, try again with a new one
+				raise
+			except BaseException:
+				connection.close()
+				raise
+			if response.will_close:
+				connection.close()
+			else:
+				self.release(connection)
+			wire_size = len(data)
+			if response.getheader('Content-Encoding', '').lower() == 'gzip':
+				from gzip import decompress
+				data = decompress(data)
+			count_transfer(tag, wire_size, len(data))
+			return response.status, response.headers, data
+
+	def close(self):
+		while True:
+			try:
+				self.idle.get_nowait().close()
+			except Empty:
+				return
+
+
+def count_transfer(tag, wire_size, size):
+	last_transfer.sizes = (wire_size, size)
+	with statistics_lock:
+		counters = statistics.setdefault(tag, [0, 0, 0])
+		counters[0] += 1
+		counters[1] += wire_size
+		counters[2] += size
+
+def reset_statistics():
+	with statistics_lock:
+		statistics.clear()
+
+def get_pool(scheme, host, port = None):
+	'''
+	Returns the shared pool for this host, creating it if needed.
+	'''
+	with pools_lock:
+		key = (scheme, host, port)
+		if key not in pools:
+			pools[key] = ConnectionPool(scheme, host, port)
+		return pools[key]
+
+def request(method, url, body = None, headers = {}, tag = None, timeout = None):
+	'''
+	Send a request to an url through the shared pools.
+	Returns a tuple (status, headers, body).
+	'''
+	u = urlsplit(url)
+	path = (u.path or '/') + ('?' + u.query if u.query else '')
+	return get_pool(u.scheme, u.hostname, u.port).request(method, path, body, headers, tag, timeout)
+
+def post(url, data, content_type = 'application/json', tag = None, timeout = None):
+	return request('POST', url, data, {'Content-Type': content_type}, tag, timeout)
+
+def close_all():
+	with pools_lock:
+		for pool in pools.values(): pool.close()
+		pools.clear()
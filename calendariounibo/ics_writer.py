@@ -0,0 +1,229 @@
+###
+# File: ics_writer.py
+#
+# Description: A streaming icalendar (RFC 5545) writer. The events are
+#                serialized straight to the output file one at a time, so
+#                no calendar object graph is kept in memory.
+#
+# Author: Francesco Tosello
+###
+
+from datetime import datetime, timezone
+from hashlib import sha1
+from collections import namedtuple
+
+# Constants
+CRLF = "\r\n"
+LINE_LENGTH = 75 # octets, longer lines must be folded
+UTC_FORMAT = "%Y%m%dT%H%M%SZ"
+LOCAL_FORMAT = "%Y%m%dT%H%M%S" # wall time of a TZID
+PRODUCT_ID = "-//calendariounibo//{}//IT"
+UID_DOMAIN = "calendariounibo"
+HASH_PROPERTY = "X-CALENDARIOUNIBO-HASH" # digest of the event contents, see event_hash
+
+TIMEZONES = { # VTIMEZONE definitions, for the events with a TZID
+	"Europe/Rome": [
+		"BEGIN:VTIMEZONE",
+		"TZID:Europe/Rome",
+		"BEGIN:DAYLIGHT",
+		"TZOFFSETFROM:+0100",
+		"TZOFFSETTO:+0200",
+		"TZNAME:CEST",
+		"DTSTART:19700329T020000",
+		"RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=-1SU",
+		"END:DAYLIGHT",
+		"BEGIN:STANDARD",
+		"TZOFFSETFROM:+0200",
+		"TZOFFSETTO:+0100",
+		"TZNAME:CET",
+		"DTSTART:19701025T030000",
+		"RRULE:FREQ=YEARLY;BYMONTH=10;BYDAY=-1SU",
+		"END:STANDARD",
+		"END:VTIMEZONE",
+	],
+}
+
+PreviousEvent = namedtuple('PreviousEvent', ['block', 'hash', 'created', 'sequence'])
+
+
+def escape_text(text):
+	'''
+	Escape a TEXT value.
+	'''
+	return str(text).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,') \
+		.replace('\r\n', '\\n').replace('\n', '\\n')
+
+def fold(line):
+	'''
+	Split a content line in chunks of at most LINE_LENGTH octets, without
+	 breaking multi-byte characters. Returns the line with its terminator.
+	'''
+	if len(line) <= LINE_LENGTH // 4 or len(line.encode()) <= LINE_LENGTH:
+		return line + CRLF
+	chunks = []
+	chunk, size = "", 0
+	limit = LINE_LENGTH
+	for char in line:
+		char_size = len(char.encode())
+		if size + char_size > limit:
+			chunks.append(chunk)
+			chunk, size = "", 0
+			limit = LINE_LENGTH - 1 # the continuation lines start with a space
+		chunk += char
+		size += char_size
+	chunks.append(chunk)
+	return (CRLF + " ").join(chunks) + CRLF
+
+def format_datetime(date):
+	'''
+	Format an aware datetime as UTC.
+	'''
+	return date.astimezone(timezone.utc).strftime(UTC_FORMAT)
+
+def format_local(date):
+	'''
+	Format the wall time of a datetime, its timezone is ignored.
+	'''
+	return date.strftime(LOCAL_FORMAT)
+
+def content_line(name, value):
+	return fold("{}:{}".format(name, value))
+
+def parse_datetime(value):
+	return datetime.strptime(value, UTC_FORMAT).replace(tzinfo = timezone.utc)
+
+def event_hash(begin, end, name, description = None, location = None, url = None, *recurrence):
+	'''
+	Returns a digest of the properties of an event, to know if it changed.
+	The recurrence is given by recurrence_key.
+	'''
+	properties = [format_datetime(begin), format_datetime(end), name, description, location, url] + list(recurrence)
+	return sha1("\x1f".join("" if p is None else str(p) for p in properties).encode()).hexdigest()
+
+def event_uid(*keys):
+	'''
+	Returns a stable UID for the event identified by these keys.
+	'''
+	return "{}@{}".format(sha1("|".join(str(k) for k in keys).encode()).hexdigest(), UID_DOMAIN)
+
+def recurrence_lines(tzid, count = None, exdates = (), rdates = ()):
+	'''
+	Returns the content lines of a weekly recurrence: count occurrences from
+	 the start, except the exdates, plus the rdates (wall times in tzid).
+	An empty string if there's no recurrence.
+	'''
+	if not count and not rdates: return ""
+	lines = []
+	if count: lines.append(content_line("RRULE", "FREQ=WEEKLY;COUNT={:d}".format(count)))
+	if exdates: lines.append(content_line("EXDATE;TZID=" + tzid, ",".join(format_local(d) for d in exdates)))
+	if rdates: lines.append(content_line("RDATE;TZID=" + tzid, ",".join(format_local(d) for d in rdates)))
+	return "".join(lines)
+
+def recurrence_key(tzid = None, count = None, exdates = (), rdates = ()):
+	'''
+	Returns the extra arguments of event_hash for these serialize_event options.
+	'''
+	return [tzid, recurrence_lines(tzid, count, exdates, rdates)] if tzid else []
+
+def serialize_event(uid, begin, end, created, name, description = None, location = None, url = None, \
+	stamp = None, sequence = 0, tzid = None, count = None, exdates = (), rdates = ()):
+	'''
+	Returns a VEVENT component as a string.
+	The stamp defaults to the creation date, the sequence counts the revisions.
+	With a tzid (see TIMEZONES) begin and end are written as wall times of
+	 that timezone, and the event may recur weekly (see recurrence_lines).
+	'''
+	return complete_fragment(serialize_fragment(uid, begin, end, name, description, location, url, sequence, \
+		tzid, count, exdates, rdates), timestamps(created, stamp))
+
+def timestamps(created, stamp = None):
+	'''
+	Returns the DTSTAMP and CREATED lines of an event, see serialize_event.
+	'''
+	return content_line("DTSTAMP", format_datetime(stamp or created)) + content_line("CREATED", format_datetime(created))
+
+def complete_fragment(fragment, timestamp_lines):
+	'''
+	Returns a VEVENT component from a fragment and its timestamps.
+	'''
+	return fragment[0] + timestamp_lines + fragment[1]
+
+def serialize_fragment(uid, begin, end, name, description = None, location = None, url = None, sequence = 0, \
+	tzid = None, count = None, exdates = (), rdates = ()):
+	'''
+	Returns a VEVENT component without its timestamps, as a tuple of the
+	 strings before and after them (see complete_fragment): unlike the whole
+	 event it doesn't depend on when it is written, so it can be shared by
+	 many calendars. See serialize_event for the parameters.
+	'''
+	if tzid:
+		dates = [content_line("DTSTART;TZID=" + tzid, format_local(begin)), \
+			content_line("DTEND;TZID=" + tzid, format_local(end))]
+	else:
+		dates = [content_line("DTSTART", format_datetime(begin)), content_line("DTEND", format_datetime(end))]
+	head = "BEGIN:VEVENT" + CRLF + content_line("UID", uid)
+	lines = dates + [
+		content_line("SUMMARY", escape_text(name)),
+	]
+	if tzid: lines.append(recurrence_lines(tzid, count, exdates, rdates))
+	if description: lines.append(content_line("DESCRIPTION", escape_text(description)))
+	if location: lines.append(content_line("LOCATION", escape_text(location)))
+	if url: lines.append(content_line("URL", url))
+	if sequence: lines.append(content_line("SEQUENCE", sequence))
+	lines.append(content_line(HASH_PROPERTY, event_hash(begin, end, name, description, location, url, \
+		*recurrence_key(tzid, count, exdates, rdates))))
+	lines.append("END:VEVENT" + CRLF)
+	return head, "".join(lines)
+
+def read_events(stream):
+	'''
+	Read the events of a calendar previously written by this module.
+	Returns a dictionary: UID -> PreviousEvent. The blocks are kept verbatim.
+	'''
+	events = {}
+	block = None
+	for line in stream:
+		if line.startswith("BEGIN:VEVENT"):
+			block = [line]
+			props = {}
+		elif block is not None:
+			block.append(line)
+			if line.startswith("END:VEVENT"):
+				if "UID" in props and "CREATED" in props:
+					events[props["UID"]] = PreviousEvent("".join(block), props.get(HASH_PROPERTY), \
+						parse_datetime(props["CREATED"]), int(props.get("SEQUENCE", 0)))
+				block = None
+			elif not line.startswith(" "):
+				name, _, value = line.rstrip(CRLF).partition(":")
+				props[name] = value
+	return events
+
+class CalendarWriter():
+	'''
+	Writes a VCALENDAR to a text file, one event at a time.
+	The timezones (see TIMEZONES) used by the events must be listed.
+	Use it as a context manager:
+		with CalendarWriter(ics_file, creator) as calendar:
+			calendar.write(serialize_event(...))
+	'''
+	def __init__(self, stream, creator, timezones = ()):
+		self.stream = stream
+		self.creator = creator
+		self.timezones = timezones
+
+	def __enter__(self):
+		self.stream.write("BEGIN:VCALENDAR" + CRLF)
+		self.stream.write(content_line("VERSION", "2.0"))
+		self.stream.write(content_line("PRODID", PRODUCT_ID.format(self.creator)))
+		self.stream.write(content_line("CALSCALE", "GREGORIAN"))
+		for tzid in self.timezones:
+			self.stream.write("".join(fold(line) for line in TIMEZONES[tzid]))
+		return self
+
+	def write(self, event):
+		self.stream.write(event)
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if exc_type is None:
+			self.stream.write("END:VCALENDAR" + CRLF)
+		return False
@@ -0,0 +1,166 @@
+###
+# File: profiling.py
+#
+# Description: Instrumentation of the downloader: every stage and every
+#                datastore request produce a report with the wall time, the
+#                transferred bytes, the records and (if tracing) the peak
+#                memory. The reports are collected for --profile and sent to
+#                the registered listeners, e.g. a scheduler embedding this.
+#
+# Author: Francesco Tosello
+###
+
+from contextlib import contextmanager
+from threading import Lock, local
+from time import perf_counter, time
+from json import dumps as to_json_bytes
+import http_client
+
+# Constants
+KIND_STAGE = "stage"
+KIND_FETCH = "fetch"
+
+enabled = False # collect the reports, see enable
+tracing = False # the memory allocations, with tracemalloc (imported only if needed)
+listeners = [] # callables (kind, report)
+reports = {KIND_STAGE: [], KIND_FETCH: []}
+records_count = 0 # records decoded so far, see count_records
+stacks = local() # running stages of every thread, the innermost last
+lock = Lock()
+started = None
+
+
+def active():
+	'''
+	Whether the reports are needed by someone: if not the hooks do nothing.
+	'''
+	return enabled or bool(listeners)
+
+def add_listener(callback):
+	'''
+	Call callback(kind, report) for every finished stage (KIND_STAGE) and
+	 datastore request (KIND_FETCH). The reports are dictionaries, see stage
+	 and fetch. The callback may be called from the worker threads.
+	'''
+	listeners.append(callback)
+
+def remove_listener(callback):
+	listeners.remove(callback)
+
+def enable(memory = True):
+	'''
+	Start collecting the reports, tracing the memory allocations if requested
+	 (it makes everything slower).
+	'''
+	global enabled, started, tracing
+	enabled = True
+	started = time()
+	if memory:
+		import tracemalloc
+		if not tracemalloc.is_tracing(): tracemalloc.start()
+		tracing = True
+
+def disable():
+	global enabled, tracing
+	enabled = False
+	if tracing:
+		import tracemalloc
+		tracemalloc.stop()
+		tracing = False
+
+def publish(kind, report):
+	if enabled:
+		with lock:
+			reports[kind].append(report)
+	for callback in list(listeners):
+		callback(kind, report)
+
+def count_records(count):
+	global records_count
+	if not active(): return
+	with lock:
+		records_count += count
+
+def running_stages():
+	if not hasattr(stacks, 'stages'): stacks.stages = []
+	return stacks.stages
+
+def transferred():
+	'''
+	Returns the totals (requests, bytes on the wire, decoded bytes) of http_client.
+	'''
+	with http_client.statistics_lock:
+		counters = list(http_client.statistics.values())
+	return tuple(sum(c[i] for c in counters) for i in range(3))
+
+@contextmanager
+def stage(name):
+	'''
+	Measure the code inside a with block as a stage of the pipeline.
+	The report has: name, seconds, requests, wire_bytes, bytes, records and
+	 peak_memory (bytes allocated at most over the start, None if not tracing).
+	The counters are global, so the stages running in other threads at the
+	 same time are counted too.
+	'''
+	if not active():
+		yield
+		return
+	stack = running_stages()
+	traced = tracing
+	entry = {'peak': 0}
+	if traced:
+		import tracemalloc
+		entry['memory'] = tracemalloc.get_traced_memory()[0]
+		tracemalloc.reset_peak()
+	requests, wire_size, size = transferred()
+	records = records_count
+	stack.append(entry)
+	start = perf_counter()
+	try:
+		yield
+	finally:
+		seconds = perf_counter() - start
+		stack.pop()
+		peak = None
+		if traced and tracing:
+			absolute_peak = max(tracemalloc.get_traced_memory()[1], entry['peak'])
+			if stack: stack[-1]['peak'] = max(stack[-1]['peak'], absolute_peak) # the inner stages reset the peak
+			peak = absolute_peak - entry['memory']
+		end_requests, end_wire_size, end_size = transferred()
+		publish(KIND_STAGE, {'name': name, 'seconds': seconds, 'requests': end_requests - requests, \
+			'wire_bytes': end_wire_size - wire_size, 'bytes': end_size - size, 'records': records_count - records, \
+			'peak_memory': peak})
+
+def fetch(resource, seconds, network, decoding, wire_size, size, records, cached):
+	'''
+	Report a datastore request: seconds in total, of which network waiting
+	 for the response and decoding its json. The cached responses have no
+	 network time and no wire bytes.
+	'''
+	publish(KIND_FETCH, {'resource': resource, 'seconds': seconds, 'network': network, 'decoding': decoding, \
+		'wire_bytes': wire_size, 'bytes': size, 'records': records, 'cached': cached})
+
+def report():
+	'''
+	Returns all the collected reports, with the totals of the requests
+	 for every resource.
+	'''
+	with lock:
+		stages = list(reports[KIND_STAGE])
+		fetches = list(reports[KIND_FETCH])
+	resources = {}
+	for f in fetches:
+		total = resources.setdefault(f['resource'], {'requests': 0, 'cached': 0, 'seconds': 0.0, 'network': 0.0, \
+			'decoding': 0.0, 'wire_bytes': 0, 'bytes': 0, 'records': 0})
+		total['requests'] += 1
+		total['cached'] += int(f['cached'])
+		for key in ['seconds', 'network', 'decoding', 'wire_bytes', 'bytes', 'records']:
+			total[key] += f[key]
+	return {'started': started, 'stages': stages, 'resources': resources, 'fetches': fetches}
+
+def write_report(filename):
+	try:
+		with open(filename, 'w') as report_file:
+			report_file.write(to_json_bytes(report(), indent = 1))
+	except IOError as ioe:
+		print("Unable to write the profile: {}".format(ioe))
@@ -0,0 +1,136 @@
+###
+# File: records.py
+#
+# Description: Compact types for the data that flows through the downloader.
+#                They keep only the columns that are actually used, in
+#                __slots__ instead of a dictionary, and the repeated strings
+#                (teachers, rooms, descriptions...) are interned.
+#
+# Author: Francesco Tosello
+###
+
+from api_constants import *
+from sys import intern
+
+
+def text(value):
+	'''
+	Returns an interned string, None if the value is null.
+	'''
+	return None if value is None else intern(str(value))
+
+def integer(value):
+	return None if value is None or value == "" else int(value)
+
+
+class Record():
+	'''
+	Base class: the attributes are listed in __slots__, FIELDS are the
+	 columns of the datastore needed to build them (see from_record).
+	'''
+	__slots__ = ()
+	FIELDS = []
+
+	def __init__(self, *values):
+		for name, value in zip(self.__slots__, values):
+			setattr(self, name, value)
+
+	def __repr__(self):
+		return "{}({})".format(type(self).__name__, \
+			", ".join("{}={!r}".format(name, getattr(self, name)) for name in self.__slots__))
+
+	def __getstate__(self): # needed to send them to other processes
+		return tuple(getattr(self, name) for name in self.__slots__)
+
+	def __setstate__(self, state):
+		Record.__init__(self, *state)
+
+
+class Curriculum(Record):
+	'''
+	A curriculum of a degree course (RESOURCE_CURRICULA_AVAILABLE).
+	'''
+	__slots__ = ('code', 'description', 'notes', 'course_code', 'course_description')
+	FIELDS = [FIELD_CURRICULUM_CODE, FIELD_CURRICULUM_DESCRIPTION, FIELD_CURRICULUM_NOTES, \
+		FIELD_CURRICULUM_COURSE_CODE, FIELD_CURRICULUM_COURSE_DESCRIPTION]
+
+	@classmethod
+	def from_record(cls, record):
+		return cls(text(record[FIELD_CURRICULUM_CODE]), text(record[FIELD_CURRICULUM_DESCRIPTION]), \
+			record.get(FIELD_CURRICULUM_NOTES), text(record.get(FIELD_CURRICULUM_COURSE_CODE)), \
+			text(record.get(FIELD_CURRICULUM_COURSE_DESCRIPTION)))
+
+
+class CurriculumGroup(Record):
+	'''
+	A group of teachings in the structure of a curriculum, for an year
+	 (RESOURCE_CURRICULA_STRUCTURE). The year column is spelled
+	 FIELD_CURRICULUM_GROUP_YEAR in the documentation of the dataset, the
+	 usual FIELD_CURRICULUM_YEAR is accepted too: request all the columns.
+	'''
+	__slots__ = ('curriculum', 'year', 'id', 'father_id')
+	FIELDS = [FIELD_CURRICULUM_CODE, FIELD_CURRICULUM_GROUP_YEAR, FIELD_CURRICULUM_GROUP_ID, \
+		FIELD_CURRICULUM_GROUP_FATHER]
+
+	@classmethod
+	def from_record(cls, record):
+		return cls(text(record[FIELD_CURRICULUM_CODE]), \
+			integer(record.get(FIELD_CURRICULUM_GROUP_YEAR, record.get(FIELD_CURRICULUM_YEAR))), \
+			text(record.get(FIELD_CURRICULUM_GROUP_ID)), text(record.get(FIELD_CURRICULUM_GROUP_FATHER)))
+
+
+class CurriculumTeaching(Record):
+	'''
+	A teaching listed in a curriculum (RESOURCE_CURRICULA_DETAILS).
+	'''
+	__slots__ = ('curriculum', 'year', 'id', 'description', 'active')
+	FIELDS = [FIELD_CURRICULUM_CODE, FIELD_CURRICULUM_YEAR, FIELD_CURRICULUM_TEACHING_ID, \
+		FIELD_CURRICULUM_SUBJECT_DESCRIPTION, FIELD_CURRICULUM_ACTIVE]
+
+	@classmethod
+	def from_record(cls, record):
+		return cls(text(record[FIELD_CURRICULUM_CODE]), integer(record[FIELD_CURRICULUM_YEAR]), \
+			integer(record[FIELD_CURRICULUM_TEACHING_ID]), text(record[FIELD_CURRICULUM_SUBJECT_DESCRIPTION]), \
+			bool(record[FIELD_CURRICULUM_ACTIVE]))
+
+
+class Teaching(Record):
+	'''
+	A node of a teaching tree: a simple teaching, a module or a fork
+	 (RESOURCE_TEACHING_DETAILS). In the downloader these are the courses.
+	'''
+	__slots__ = ('id', 'father_id', 'root_id', 'type', 'description', 'teacher', 'language', 'url')
+	FIELDS = [FIELD_TEACHING_ID, FIELD_TEACHING_FATHER_ID, FIELD_TEACHING_ROOT_ID, FIELD_TEACHING_TYPE, \
+		FIELD_TEACHING_SUBJECT_DESCRIPTION, FIELD_TEACHING_TEACHER_NAME, FIELD_TEACHING_LANGUAGE, FIELD_TEACHING_URL]
+
+	@classmethod
+	def from_record(cls, record):
+		return cls(integer(record[FIELD_TEACHING_ID]), integer(record[FIELD_TEACHING_FATHER_ID]), \
+			integer(record[FIELD_TEACHING_ROOT_ID]), text(record[FIELD_TEACHING_TYPE]), \
+			text(record[FIELD_TEACHING_SUBJECT_DESCRIPTION]), text(record[FIELD_TEACHING_TEACHER_NAME]), \
+			text(record[FIELD_TEACHING_LANGUAGE]), text(record[FIELD_TEACHING_URL]))
+
+
+class Room(Record):
+	'''
+	A classroom (RESOURCE_ROOMS).
+	'''
+	__slots__ = ('code', 'name', 'address', 'floor', 'latitude', 'longitude')
+	FIELDS = [FIELD_ROOMS_ROOM_ID, FIELD_ROOMS_NAME, FIELD_ROOMS_ADDRESS, FIELD_ROOMS_FLOOR, \
+		FIELD_ROOMS_LATITUDE, FIELD_ROOMS_LONGITUDE]
+
+	@classmethod
+	def from_record(cls, record):
+		return cls(text(record[FIELD_ROOMS_ROOM_ID]), text(record[FIELD_ROOMS_NAME]), \
+			text(record[FIELD_ROOMS_ADDRESS]), text(record[FIELD_ROOMS_FLOOR]), \
+			record[FIELD_ROOMS_LATITUDE], record[FIELD_ROOMS_LONGITUDE])
+
+
+class Lecture(Record):
+	'''
+	A lecture ready to be exported: built from a timetable record
+	 (RESOURCE_TIMETABLES) and its rooms.
+	'''
+	__slots__ = ('course_id', 'start', 'end', 'notes', 'location', 'rooms')
+	FIELDS = [FIELD_TIMETABLE_TEACHING_ID, FIELD_TIMETABLE_START, FIELD_TIMETABLE_END, \
+		FIELD_TIMETABLE_NOTES, FIELD_TIMETABLE_ROOM_ID]
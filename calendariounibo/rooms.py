@@ -0,0 +1,149 @@
+###
+# File: rooms.py
+#
+# Description: A directory of all the classrooms, downloaded once and kept on
+#                disk next to the cache, refreshed every day. The locations of
+#                the lectures are built from it and memoized, since the same
+#                rooms combinations repeat for the whole semester.
+#
+# Author: Francesco Tosello
+###
+
+from api_constants import *
+from os import path, makedirs, replace, stat
+from json import loads as parse_json, dumps as to_json_bytes
+from threading import Lock
+from functools import lru_cache
+from time import time
+from records import Room
+import cache
+import snapshot
+from scheduler import DatastoreError
+
+# Constants
+DIRECTORY_FILENAME = "rooms.directory" # not CACHE_EXTENSION, it must not be evicted
+DIRECTORY_TTL = cache.DAY
+LOCATION_CACHE_SIZE = 4096 # distinct rooms combinations
+
+directory = None # room code -> Room, loaded on demand
+directory_lock = Lock()
+
+
+def directory_path():
+	return path.join(cache.directory, DIRECTORY_FILENAME)
+
+def persistent():
+	'''
+	The directory is kept on disk only when it comes from the server.
+	'''
+	return cache.mode != cache.MODE_DISABLED and not snapshot.database
+
+def read_directory():
+	'''
+	Returns the directory saved by a previous run, None if it is missing or
+	 older than DIRECTORY_TTL. In offline mode it never expires.
+	'''
+	if not persistent() or cache.mode == cache.MODE_REFRESH: return None
+	filename = directory_path()
+	try:
+		if cache.mode != cache.MODE_OFFLINE and time() - stat(filename).st_mtime > DIRECTORY_TTL:
+			return None
+		with open(filename, encoding = 'utf-8') as directory_file:
+			return {code: Room(*values) for code, values in parse_json(directory_file.read()).items()}
+	except (IOError, OSError, ValueError, TypeError):
+		return None
+
+def write_directory(rooms):
+	if not persistent() or cache.mode == cache.MODE_OFFLINE: return
+	filename = directory_path()
+	try:
+		makedirs(path.dirname(filename), exist_ok = True)
+		with open(filename + ".tmp", 'w', encoding = 'utf-8') as directory_file:
+			directory_file.write(to_json_bytes({code: r.__getstate__() for code, r in rooms.items()}))
+		replace(filename + ".tmp", filename)
+	except (IOError, OSError) as ioe:
+		print("Unable to save the rooms directory: {}".format(ioe))
+
+def download_rooms(filters = {}):
+	'''
+	Returns a dictionary: room code -> Room, for the rooms matching the filters.
+	'''
+	from downloader import iter_records, columns # avoid a circular import
+	return {r.code: r for r in (Room.from_record(r) for r in iter_records(RESOURCE_ROOMS, filters, columns(Room)))}
+
+def get_directory():
+	'''
+	Returns the rooms directory, downloading it if needed.
+	'''
+	global directory
+	with directory_lock:
+		if directory is None:
+			directory = read_directory()
+			if directory is None:
+				directory = download_rooms()
+				write_directory(directory)
+			build_location.cache_clear()
+		return directory
+
+def refresh_directory():
+	'''
+	Download the directory again. The one in memory is replaced only when
+	 the new one is complete, so the running lookups are not affected.
+	'''
+	global directory
+	rooms = download_rooms()
+	with directory_lock:
+		directory = rooms
+		write_directory(directory)
+		build_location.cache_clear()
+
+def find_rooms(codes):
+	'''
+	Make sure that these rooms are in the directory: the ones added after the
+	 last refresh are downloaded and saved. Offline, or if the download fails,
+	 they are left out: build_location shows their codes.
+	Returns the codes that don't exist at all (or couldn't be downloaded).
+	'''
+	global directory
+	rooms = get_directory()
+	missing = set(codes) - set(rooms)
+	if not missing or cache.mode == cache.MODE_OFFLINE: return missing
+	try:
+		found = download_rooms({FIELD_ROOMS_ROOM_ID: sorted(missing)})
+	except DatastoreError as e:
+		print("Unable to download the new rooms: {}".format(e))
+		return missing
+	if found:
+		with directory_lock:
+			directory = {**(directory or rooms), **found}
+			write_directory(directory)
+			build_location.cache_clear()
+	return missing - set(found)
+
+@lru_cache(LOCATION_CACHE_SIZE)
+def build_location(classroom_ids, coordinates = False):
+	'''
+	Make a string representing the location of the classroom(s).
+	Parameters: classroom_ids is the space separated list of the room codes
+	 of a lecture, coordinates chooses the gps coordinates over the address.
+	'''
+	if not classroom_ids: return ""
+	rooms = directory or {}
+	location = ""
+	for idx, cl_id in enumerate(classroom_ids.split()):
+		if idx > 0: # not the first item
+			location += " OPPURE "
+		if cl_id not in rooms: # unknown room, the code is better than nothing
+			location += cl_id
+			continue
+		classroom = rooms[cl_id]
+		location += classroom.name.title()
+		if coordinates:
+			if classroom.latitude: # assume both coordinates null toghether
+				location += (" - {} {}".format(classroom.latitude, classroom.longitude))
+		elif classroom.floor or classroom.address:
+			location += " -"
+			if classroom.floor: location += " {}".format(classroom.floor)
+			if classroom.address:
+				location += " in {}".format(classroom.address.replace(', ', ' '))
+	return location
@@ -0,0 +1,208 @@
+###
+# File: scheduler.py
+#
+# Description: Schedules the datastore requests, so that the runs finish
+#                predictably even when the API is under load: the transient
+#                failures are retried with a jittered exponential backoff,
+#                every request has a timeout, the slow ones may be hedged
+#                (sent again, the first answer wins) and the long filter lists
+#                are split in batches sized on the observed latency and
+#                errors. The failures are raised as DatastoreError.
+#
+# Author: Francesco Tosello
+###
+
+from collections import deque
+from random import uniform
+from threading import Lock
+from time import perf_counter, sleep
+
+# Constants
+RETRIES = 4 # attempts after the first one
+BACKOFF_BASE = 0.5 # seconds, doubled at every attempt
+BACKOFF_MAX = 30 # seconds
+REQUEST_TIMEOUT = 30 # seconds, of every operation on the socket
+TRANSIENT_STATUSES = {408, 429, 500, 502, 503, 504}
+HEDGE_QUANTILE = 0.9 # a request is hedged when slower than this share of the previous ones
+HEDGE_MIN_DELAY = 1 # seconds
+HEDGE_MIN_SAMPLES = 10 # latencies to observe before hedging
+HEDGE_WORKERS = 16
+LATENCY_SAMPLES = 100 # kept for every resource
+BATCH_MIN = 5 # values in the filter of a batch
+BATCH_MAX = 400
+TARGET_LATENCY = 2 # seconds of a batch
+
+retries = RETRIES
+timeout = REQUEST_TIMEOUT
+hedging = False # see configure
+latencies = {} # resource -> recent latencies of the successful requests
+sizers = {} # resource -> BatchSizer
+lock = Lock()
+hedge_executor = None # created on the first hedge
+
+
+class DatastoreError(Exception):
+	'''
+	A datastore request that failed. If transient, the same request may
+	 succeed later.
+	'''
+	def __init__(self, message, transient = False):
+		super().__init__(message)
+		self.transient = transient
+
+
+class BatchSizer():
+	'''
+	The number of values to send in a filter list: it grows slowly while the
+	 batches take less than the target latency, it shrinks in proportion when
+	 they take longer and it halves on errors.
+	'''
+	def __init__(self, size, minimum = BATCH_MIN, maximum = BATCH_MAX, target = TARGET_LATENCY):
+		self.minimum = minimum
+		self.maximum = maximum
+		self.target = target
+		self.size = max(minimum, min(maximum, size))
+		self.lock = Lock()
+
+	def success(self, count, seconds):
+		with self.lock:
+			if seconds > self.target:
+				self.size = max(self.minimum, int(self.size * self.target / seconds))
+			elif count >= self.size: # only the full batches tell that more would fit
+				self.size = min(self.maximum, self.size + max(1, self.size // 4))
+
+	def failure(self):
+		with self.lock:
+			self.size = max(self.minimum, self.size // 2)
+
+
+def configure(retries_count = RETRIES, request_timeout = REQUEST_TIMEOUT, hedge = False):
+	global retries, timeout, hedging
+	retries = retries_count
+	timeout = request_timeout
+	hedging = hedge
+
+def backoff(attempt):
+	'''
+	Returns the seconds to wait before the attempt (from 1): random up to
+	 the exponential backoff, so the clients don't retry all together.
+	'''
+	return uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)))
+
+def timed(function, resource):
+	'''
+	Call function, adding its latency to the samples of the resource.
+	'''
+	start = perf_counter()
+	result = function()
+	with lock:
+		latencies.setdefault(resource, deque(maxlen = LATENCY_SAMPLES)).append(perf_counter() - start)
+	return result
+
+def hedge_delay(resource):
+	'''
+	Returns the seconds after which a request is hedged, None if the
+	 latencies of the resource are not known yet.
+	'''
+	with lock:
+		samples = sorted(latencies.get(resource, ()))
+	if len(samples) < HEDGE_MIN_SAMPLES: return None
+	return max(HEDGE_MIN_DELAY, samples[int(HEDGE_QUANTILE * (len(samples) - 1))])
+
+def hedged(function, resource):
+	'''
+	Call function, and call it again in parallel if it doesn't answer within
+	 the hedge delay: the first success wins, the other answer is discarded.
+	The requests must be idempotent (the datastore searches are).
+	'''
+	global hedge_executor
+	delay = hedge_delay(resource)
+	if delay is None: return timed(function, resource)
+	from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+	with lock:
+		if hedge_executor is None: hedge_executor = ThreadPoolExecutor(HEDGE_WORKERS)
+	first = hedge_executor.submit(timed, function, resource)
+	try:
+		return first.result(delay)
+	except TimeoutError:
+		pass
+	error = None
+	for f in as_completed([first, hedge_executor.submit(timed, function, resource)]):
+		try:
+			return f.result()
+		except Exception as e:
+			error = e
+	raise error
+
+def send(function, resource):
+	'''
+	Send a request, trying again on the transient failures.
+	Parameters: function sends the request (with the timeout of this module)
+	 and returns a tuple starting with (status, headers, body), as the one of
+	 http_client.request: anything else about the response (e.g. its sizes)
+	 must be added there, since a hedged request runs in another thread.
+	Returns the tuple of function, with a status below 400.
+	Raises DatastoreError.
+	'''
+	from http.client import HTTPException
+	delay = 0
+	for attempt in range(retries + 1):
+		if attempt: sleep(delay)
+		try:
+			response = (hedged if hedging else timed)(function, resource)
+			status, headers, body = response[:3]
+		except (HTTPException, OSError) as e: # timeouts included
+			error = DatastoreError("Unable to contact the server: {}".format(e), True)
+			delay = backoff(attempt + 1)
+		else:
+			if status < 400: return response
+			error = DatastoreError("HTTP error {}: {}".format(status, body[:200]), status in TRANSIENT_STATUSES)
+			delay = backoff(attempt + 1)
+			retry_after = headers.get('Retry-After', '')
+			if retry_after.isdigit(): delay = max(delay, min(BACKOFF_MAX, int(retry_after)))
+		if not error.transient: break
+	raise error
+
+def get_sizer(resource, size):
+	'''
+	Returns the BatchSizer of a resource, starting from size if it's new.
+	'''
+	with lock:
+		if resource not in sizers: sizers[resource] = BatchSizer(size)
+		return sizers[resource]
+
+def batches(function, values, resource, size, workers = 1):
+	'''
+	Call function on consecutive batches of the values, up to workers at the
+	 same time, and yield its results as they complete (in any order).
+	The batch size comes from the BatchSizer of the resource (starting from
+	 size), which learns from every batch. It is chosen at the start of every
+	 call, so that a rerun cuts the same batches and finds them in the cache.
+	A batch refused by the server (a DatastoreError not transient, e.g. for
+	 an oversized filter) is split in halves and tried again: the error is
+	 raised only when a single value fails. The transient errors are raised
+	 at once, send has already retried them.
+	'''
+	from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+	sizer = get_sizer(resource, size)
+	size = sizer.size
+	values = list(values)
+	queue = deque(values[i:i+size] for i in range(0, len(values), size))
+	running = {} # future -> (batch, start)
+	with ThreadPoolExecutor(workers) as executor:
+		while queue or running:
+			while queue and len(running) < workers:
+				batch = queue.popleft()
+				running[executor.submit(function, batch)] = (batch, perf_counter())
+			done, pending = wait(running, return_when = FIRST_COMPLETED)
+			for f in done:
+				batch, start = running.pop(f)
+				try:
+					result = f.result()
+				except DatastoreError as e:
+					sizer.failure()
+					if e.transient or len(batch) == 1: raise
+					queue.extendleft([batch[len(batch)//2:], batch[:len(batch)//2]])
+					continue
+				sizer.success(len(batch), perf_counter() - start)
+				yield result
@@ -0,0 +1,131 @@
+###
+# File: search.py
+#
+# Description: An inverted index over the words of the teachings descriptions.
+#                The words are normalized (lowercase, without accents) and
+#                kept sorted, so every query term is matched as a prefix with
+#                a binary search, for a search-as-you-type in the app. The
+#                trigrams of the texts are indexed too, so the name filters of
+#                the downloader find any part of a word without a full scan.
+#
+# Author: Francesco Tosello
+###
+
+from bisect import bisect_left
+from re import compile as compile_regex
+from unicodedata import normalize as unicode_normalize, combining
+
+# Constants
+WORD_REGEX = compile_regex(r'\w+')
+GRAM_LENGTH = 3 # characters of the indexed substrings, the shorter queries scan all the texts
+
+
+def normalize(text):
+	'''
+	Lowercase a text and fold its accents (e.g. 'Attività' -> 'attivita').
+	'''
+	return "".join(c for c in unicode_normalize('NFKD', str(text).lower()) if not combining(c))
+
+def tokenize(text):
+	return WORD_REGEX.findall(normalize(text))
+
+def grams(text):
+	return set(text[i:i+GRAM_LENGTH] for i in range(len(text) - GRAM_LENGTH + 1))
+
+
+class TeachingIndex():
+	'''
+	Index the records by the words and the trigrams of a text attribute (its
+	 name, or a function of the record returning the text).
+	The queries return positions in the list of records: ranked by relevance
+	 for search, in order for the substring matches.
+	'''
+	def __init__(self, records = (), field = 'description'):
+		self.field = field
+		self.records = []
+		self.texts = [] # normalized texts, to check the phrases
+		self.postings = {} # word -> positions of the records containing it
+		self.gram_postings = {} # trigram -> positions of the records containing it
+		self.words = None # sorted words, built on demand
+		for record in records: self.add(record)
+
+	def add(self, record):
+		position = len(self.records)
+		self.records.append(record)
+		text = normalize((self.field(record) if callable(self.field) else getattr(record, self.field)) or "")
+		self.texts.append(text)
+		for word in set(WORD_REGEX.findall(text)):
+			self.postings.setdefault(word, []).append(position)
+		for gram in grams(text):
+			self.gram_postings.setdefault(gram, []).append(position)
+		self.words = None
+		return position
+
+	def expand(self, prefix):
+		'''
+		Returns the indexed words starting with this prefix.
+		'''
+		if self.words is None: self.words = sorted(self.postings)
+		start = bisect_left(self.words, prefix)
+		end = start
+		while end < len(self.words) and self.words[end].startswith(prefix):
+			end += 1
+		return self.words[start:end]
+
+	def search(self, query, limit = None):
+		'''
+		Returns the positions of the records with a word starting with every
+		 term of the query. The records matching whole words come first, then
+		 the shorter texts.
+		'''
+		terms = tokenize(query)
+		if not terms: return []
+		scores = None
+		for term in sorted(set(terms), key = len, reverse = True): # longer terms are more selective
+			matches = {}
+			for word in self.expand(term):
+				for position in self.postings[word]:
+					if word == term or position not in matches: matches[position] = 2 if word == term else 1
+			if scores is None:
+				scores = matches
+			else:
+				scores = {p: s + matches[p] for p, s in scores.items() if p in matches}
+			if not scores: return []
+		ranking = sorted(scores, key = lambda p: (-scores[p], len(self.texts[p]), p))
+		return ranking[:limit] if limit else ranking
+
+	def candidates(self, substring):
+		'''
+		Returns the positions of the records that may contain a substring:
+		 the ones with all its trigrams, all of them if it's shorter.
+		'''
+		if len(substring) < GRAM_LENGTH: return set(range(len(self.records)))
+		postings = sorted((self.gram_postings.get(g, ()) for g in grams(substring)), key = len)
+		found = set(postings[0])
+		for positions in postings[1:]:
+			if not found: break
+			found.intersection_update(positions)
+		return found
+
+	def match_phrase(self, query):
+		'''
+		Returns the positions of the records whose text contains the whole
+		 query, anywhere (e.g. 'nalisi' matches 'Analisi').
+		'''
+		phrase = normalize(query).strip()
+		if not phrase: return []
+		return sorted(p for p in self.candidates(phrase) if phrase in self.texts[p])
+
+	def match_words(self, query):
+		'''
+		Returns the positions of the records whose text contains every word
+		 of the query, anywhere and in any order.
+		'''
+		terms = normalize(query).split()
+		if not terms: return []
+		found = None
+		for term in sorted(set(terms), key = len, reverse = True): # longer terms are more selective
+			matches = self.candidates(term)
+			found = matches if found is None else found & matches
+			if not found: return []
+		return sorted(p for p in found if all(term in self.texts[p] for term in terms))
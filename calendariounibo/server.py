@@ -0,0 +1,331 @@
+#! /usr/bin/env python3
+
+
+###
+# File: server.py
+#
+# Description: An HTTP server of calendar feeds, so that the students can
+#                subscribe to an url instead of importing a file:
+#                  /curriculum/<curriculum code>/year/<year>.ics[?fork=<regex>][&weekly=1]
+#                The calendars are built with the downloader pipeline, kept in
+#                memory and rebuilt in background when the datasets change
+#                (or once a day anyway), so the polling clients never trigger
+#                a download.
+#
+# Author: Francesco Tosello
+###
+
+from api_constants import *
+from argparse import ArgumentParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from http.client import HTTPException
+from urllib.parse import urlsplit, parse_qs
+from email.utils import formatdate
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Thread, Event
+from datetime import datetime, timedelta
+from hashlib import sha1
+from io import StringIO
+from json import loads as parse_json, dumps as to_json_bytes
+from os import stat
+from re import compile as compile_regex
+from time import time
+import downloader
+from downloader import fetch_teachings, fetch_teaching_trees, resolve_courses, retrieve_timetables, stream_events, \
+	add_source_arguments, configure_source, DATE_FORMAT, CALENDAR_CREATOR, TIMEZONE
+from ics_writer import CalendarWriter, read_events
+import cache
+import http_client
+import rooms
+import snapshot
+from scheduler import DatastoreError
+
+# Constants
+FEED_PATH_REGEX = compile_regex(r'^/curriculum/([^/]+)/year/(\d+)\.ics$')
+FORK_PARAMETER = "fork" # query string parameter, see downloader.py --fork-regex
+WEEKLY_PARAMETER = "weekly" # query string parameter, see downloader.py --weekly
+FEED_CACHE_SIZE = 256 # rendered calendars kept in memory
+BUILD_WORKERS = 2 # background rebuilds at the same time
+POLL_INTERVAL = cache.HOUR # seconds between the checks of the datasets
+REBUILD_AGE = cache.DAY # seconds, the feeds are rebuilt even if no new version of the datasets is seen
+RETRY_DELAY = 60 # seconds before building again a feed that failed for the server
+HISTORY_DAYS = 30 # the feeds keep the lectures of the last days too
+MAX_AGE = cache.HOUR # suggested to the clients
+CONTENT_TYPE = "text/calendar; charset=utf-8"
+DEFAULT_HOST = "localhost"
+DEFAULT_PORT = 8080
+WATCHED_RESOURCES = [ # a new version of one of these changes the calendars
+	RESOURCE_CURRICULA_DETAILS,
+	RESOURCE_TEACHING_DETAILS,
+	RESOURCE_TIMETABLES,
+	RESOURCE_ROOMS,
+]
+
+
+class Feed():
+	'''
+	The rendered calendar of a (curriculum, year, fork regex, weekly) key.
+	The lock is held while building, so the concurrent requests of a missing
+	 feed wait for a single build instead of starting their own.
+	'''
+	def __init__(self, key):
+		self.key = key
+		self.lock = Lock()
+		self.body = None # bytes
+		self.etag = None
+		self.modified = None # time of the last change of the body
+		self.version = None # of the datasets it was built from
+		self.built = None # time of the last build
+		self.status = None # http error of the last build, if it failed
+		self.rebuilding = False
+
+
+class FeedCache():
+	'''
+	A thread safe LRU dictionary of feeds, bounded to size entries.
+	'''
+	def __init__(self, size = FEED_CACHE_SIZE):
+		self.size = size
+		self.feeds = OrderedDict()
+		self.lock = Lock()
+
+	def get(self, key):
+		'''
+		Returns the feed of this key, a new empty one if it is missing.
+		'''
+		with self.lock:
+			feed = self.feeds.get(key)
+			if feed is None:
+				feed = self.feeds[key] = Feed(key)
+				while len(self.feeds) > self.size:
+					self.feeds.popitem(last = False)
+			else:
+				self.feeds.move_to_end(key)
+			return feed
+
+	def values(self):
+		with self.lock:
+			return list(self.feeds.values())
+
+
+def build_calendar(curriculum, year, fork_regex = None, previous = None, weekly = False):
+	'''
+	Run the downloader pipeline for a feed, without asking anything: the
+	 forks that the regex doesn't decide are all included.
+	The unchanged events of the previous calendar (bytes) are kept verbatim,
+	 so a rebuild with the same lectures gives exactly the same bytes.
+	Returns the calendar as bytes. Exits like the downloader on errors.
+	'''
+	teachings = fetch_teachings(curriculum, year)
+	courses = resolve_courses(teachings, fetch_teaching_trees(teachings), fork_regex, interactive = False)
+	start = (datetime.today() - timedelta(HISTORY_DAYS)).strftime(DATE_FORMAT)
+	timetables = retrieve_timetables(courses, start)
+	old_events = read_events(StringIO(previous.decode('utf-8'), newline = '')) if previous else {}
+	stream = StringIO(newline = '')
+	with CalendarWriter(stream, CALENDAR_CREATOR, [TIMEZONE] if weekly else []) as calendar:
+		stream_events(calendar, {c.id: c for c in courses}, timetables, old_events, weekly = weekly)
+	return stream.getvalue().encode('utf-8')
+
+def datasets_version():
+	'''
+	Returns a string that changes whenever the datasets are updated (the last
+	 modification dates of the resources), None if it can't be known now.
+	'''
+	if snapshot.database: return str(stat(snapshot.database).st_mtime)
+	if cache.mode == cache.MODE_OFFLINE: return cache.MODE_OFFLINE
+	dates = []
+	for resource in WATCHED_RESOURCES:
+		try:
+			status, headers, body = http_client.post(RESOURCE_SHOW_URL, \
+				to_json_bytes({ID_PARAMETER: resource}).encode(), tag = RESOURCE_SHOW_URL)
+			if status != 200: raise HTTPException("HTTP error {}".format(status))
+			result = parse_json(body)['result']
+		except (HTTPException, OSError, ValueError, KeyError, TypeError) as e:
+			print("Unable to check the version of {}: {}".format(resource, e))
+			return None
+		dates.append(result.get(FIELD_RESOURCE_LAST_MODIFIED) or result.get(FIELD_RESOURCE_METADATA_MODIFIED))
+	return "|".join(str(d) for d in dates)
+
+
+class FeedServer(ThreadingHTTPServer):
+	'''
+	Serves the feeds and keeps them up to date.
+	'''
+	daemon_threads = True
+
+	def __init__(self, address, cache_size = FEED_CACHE_SIZE, poll_interval = POLL_INTERVAL):
+		super().__init__(address, FeedHandler)
+		self.feeds = FeedCache(cache_size)
+		self.poll_interval = poll_interval
+		self.version = datasets_version() or ""
+		self.builder = ThreadPoolExecutor(BUILD_WORKERS)
+		self.stopped = Event()
+		self.poller = Thread(target = self.poll, daemon = True)
+		self.poller.start()
+
+	def build(self, feed):
+		'''
+		Build a feed, the caller holds its lock.
+		'''
+		version = self.version
+		curriculum, year, fork_regex, weekly = feed.key
+		feed.built = time()
+		try:
+			body = build_calendar(curriculum, year, fork_regex, feed.body, weekly)
+		except (SystemExit, DatastoreError) as e: # the pipeline exits on the other errors
+			feed.status = 404 if isinstance(e, SystemExit) and not e.code else 502 # 0: no teachings found
+			feed.version = version
+			return
+		if body != feed.body:
+			feed.body = body
+			feed.etag = '"{}"'.format(sha1(body).hexdigest())
+			feed.modified = time()
+		feed.status = None
+		feed.version = version
+
+	def rebuild(self, feed):
+		try:
+			with feed.lock:
+				self.build(feed)
+		finally:
+			feed.rebuilding = False
+
+	def schedule_rebuild(self, feed):
+		'''
+		Rebuild a feed in background, unless it is already being rebuilt.
+		'''
+		with self.feeds.lock:
+			if feed.rebuilding: return
+			feed.rebuilding = True
+		self.builder.submit(self.rebuild, feed)
+
+	def expired(self, feed):
+		'''
+		Whether a feed must be built again: never built, built from an older
+		 version of the datasets, failed for the server more than RETRY_DELAY
+		 seconds ago or older than REBUILD_AGE (the version may be unknown).
+		'''
+		if feed.built is None or feed.version != self.version: return True
+		return time() - feed.built > (RETRY_DELAY if feed.status == 502 else REBUILD_AGE)
+
+	def get_feed(self, key):
+		'''
+		Returns the feed of this key, building it if needed.
+		An expired feed is returned as it is while its rebuild goes on in
+		 background, if it has a calendar.
+		'''
+		feed = self.feeds.get(key)
+		if feed.body is None:
+			if self.expired(feed):
+				with feed.lock: # single flight: the other requests wait for this build
+					if feed.body is None and self.expired(feed):
+						self.build(feed)
+		elif self.expired(feed):
+			self.schedule_rebuild(feed)
+		return feed
+
+	def poll(self):
+		'''
+		Check periodically the datasets, rebuilding the cached feeds when they
+		 change or when they expire anyway.
+		'''
+		while not self.stopped.wait(self.poll_interval):
+			version = datasets_version()
+			if version is not None and version != self.version:
+				try:
+					if not snapshot.database: rooms.refresh_directory()
+					self.version = version
+				except DatastoreError as e:
+					print("Unable to refresh the rooms directory: {}".format(e)) # try again at the next poll
+			for feed in self.feeds.values():
+				if feed.body is not None and self.expired(feed): self.schedule_rebuild(feed)
+
+	def server_close(self):
+		self.stopped.set()
+		self.builder.shutdown(wait = False)
+		super().server_close()
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+	'''
+	Answers the GET (and HEAD) requests of the feeds, with ETag validation.
+	'''
+	protocol_version = 'HTTP/1.1'
+	disable_nagle_algorithm = True # headers and body are sent apart, don't wait for the delayed ack
+
+	def do_GET(self):
+		self.send_feed(True)
+
+	def do_HEAD(self):
+		self.send_feed(False)
+
+	def send_feed(self, with_body):
+		url = urlsplit(self.path)
+		match = FEED_PATH_REGEX.match(url.path)
+		if not match:
+			return self.send_status(404, with_body)
+		query = parse_qs(url.query)
+		fork_regex = query.get(FORK_PARAMETER, [None])[-1]
+		weekly = query.get(WEEKLY_PARAMETER, ["0"])[-1] not in ("0", "false", "no")
+		feed = self.server.get_feed((match.group(1), int(match.group(2)), fork_regex, weekly))
+		body, etag, modified = feed.body, feed.etag, feed.modified # a rebuild may replace them
+		if body is None:
+			return self.send_status(feed.status or 502, with_body)
+		not_modified = etag_matches(self.headers.get('If-None-Match'), etag)
+		self.send_response(304 if not_modified else 200)
+		self.send_header('ETag', etag)
+		self.send_header('Last-Modified', formatdate(modified, usegmt = True))
+		self.send_header('Cache-Control', "max-age={:d}".format(MAX_AGE))
+		if not_modified:
+			self.end_headers()
+			return
+		self.send_header('Content-Type', CONTENT_TYPE)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		if with_body: self.wfile.write(body)
+
+	def send_status(self, status, with_body):
+		body = "{} {}\n".format(status, self.responses[status][0]).encode()
+		self.send_response(status)
+		self.send_header('Content-Type', "text/plain; charset=utf-8")
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		if with_body: self.wfile.write(body)
+
+
+def etag_matches(header, etag):
+	'''
+	Check an If-None-Match header (a list of entity tags, or *) against an etag.
+	'''
+	if not header or not etag: return False
+	tags = [t.strip() for t in header.split(',')]
+	return '*' in tags or etag in (t[2:] if t.startswith('W/') else t for t in tags)
+
+def parse_args():
+	parser = ArgumentParser(description = "Serve the calendars as feeds to subscribe to.", \
+		epilog = "written by " + downloader.__AUTHOR__)
+	parser.add_argument('--host', default = DEFAULT_HOST, help = "Listen on this address. Default localhost.")
+	parser.add_argument('-p', '--port', type = int, default = DEFAULT_PORT, help = "Listen on this port. Default 8080.")
+	parser.add_argument('--feeds', type = int, default = FEED_CACHE_SIZE, help = "Calendars kept in memory.")
+	parser.add_argument('--poll', type = int, default = POLL_INTERVAL, \
+		help = "Seconds between the checks for new datasets. Default one hour.")
+	add_source_arguments(parser)
+	args = parser.parse_args()
+	configure_source(args)
+	if not args.cache_mode: # the feeds are rebuilt only when the datasets change, they must be fresh
+		cache.configure(cache.MODE_REFRESH)
+	return (args.host, args.port), args.feeds, args.poll
+
+def main(address = (DEFAULT_HOST, DEFAULT_PORT), cache_size = FEED_CACHE_SIZE, poll_interval = POLL_INTERVAL):
+	server = FeedServer(address, cache_size, poll_interval)
+	print("Serving the feeds on http://{}:{:d}/curriculum/<code>/year/<year>.ics".format(*server.server_address[:2]))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+
+if __name__ == '__main__':
+	main(*parse_args())
@@ -0,0 +1,162 @@
+#! /usr/bin/env python3
+
+
+###
+# File: snapshot.py
+#
+# Description: Downloads all the datastore resources into a local SQLite
+#                database, then answers the same queries of the datastore
+#                without any network access.
+#
+# Note: Run this file to build (or update) the snapshot, then pass it to the
+#        other scripts with --snapshot.
+#
+# Author: Francesco Tosello
+###
+
+from api_constants import *
+from argparse import ArgumentParser
+from os import path, makedirs, remove, replace
+from threading import local
+from json import loads as parse_json, dumps as to_json_bytes
+from time import time
+import cache
+
+# Constants
+DEFAULT_SNAPSHOT = path.join(cache.CACHE_DIRECTORY, "snapshot.sqlite")
+SNAPSHOT_RESOURCES = [
+	RESOURCE_CURRICULA_AVAILABLE,
+	RESOURCE_CURRICULA_STRUCTURE,
+	RESOURCE_CURRICULA_DETAILS,
+	RESOURCE_TEACHING_DETAILS,
+	RESOURCE_TIMETABLES,
+	RESOURCE_ROOMS,
+]
+INDEXED_FIELDS = [ # these columns get their own indexes, the other fields are filtered in python
+	FIELD_CURRICULUM_COURSE_CODE,
+	FIELD_CURRICULUM_CODE,
+	FIELD_CURRICULUM_YEAR,
+	FIELD_TEACHING_ID,
+	FIELD_TEACHING_ROOT_ID,
+	FIELD_TEACHING_FATHER_ID,
+	FIELD_ROOMS_ROOM_ID,
+	FIELD_TIMETABLE_START, # iso dates, their text order is the chronological one
+]
+RECORD_COLUMN = "record" # the whole record as json
+METADATA_TABLE = "snapshot_metadata"
+SQL_VARIABLES_LIMIT = 900 # keep the IN (...) lists below the sqlite limit
+
+database = None # the snapshot in use, None to query the remote datastore
+connections = local() # sqlite connections can't be shared between threads
+
+
+def quote(name):
+	return '"{}"'.format(name.replace('"', '""'))
+
+def open_snapshot(filename):
+	'''
+	Use this snapshot for all the following queries.
+	'''
+	global database
+	if not path.exists(filename):
+		print("The snapshot {} doesn't exist, build it first with snapshot.py.".format(filename))
+		exit(1)
+	database = filename
+	connections.__dict__.clear()
+
+def get_connection():
+	import sqlite3 # only when a snapshot is used
+	if getattr(connections, 'database', None) != database:
+		connections.connection = sqlite3.connect("file:{}?mode=ro".format(database), uri = True)
+		connections.database = database
+	return connections.connection
+
+def query(resource, filters = {}, fields = [], window = None):
+	'''
+	Generator of the records of a resource matching the filters, like the
+	 datastore_search API: the values of a filter may be a list of alternatives.
+	The window is a tuple (field, lowest, highest) of an indexed field, see
+	 downloader.build_sql.
+	'''
+	conditions = []
+	parameters = []
+	late_filters = {} # not indexed, checked on the decoded records
+	for field, value in (filters or {}).items():
+		values = [str(v) for v in value] if isinstance(value, (list, tuple, set)) else [str(value)]
+		if field in INDEXED_FIELDS and len(values) <= SQL_VARIABLES_LIMIT:
+			conditions.append("{} IN ({})".format(quote(field), ", ".join("?" * len(values))))
+			parameters += values
+		else:
+			late_filters[field] = set(values)
+	if window:
+		field, lowest, highest = window
+		if lowest is not None:
+			conditions.append("{} >= ?".format(quote(field)))
+			parameters.append(str(lowest))
+		if highest is not None:
+			conditions.append("{} <= ?".format(quote(field)))
+			parameters.append(str(highest))
+	sql = "SELECT {} FROM {}".format(RECORD_COLUMN, quote(resource))
+	if conditions: sql += " WHERE " + " AND ".join(conditions)
+	sql += " ORDER BY rowid"
+	import sqlite3
+	try:
+		rows = get_connection().execute(sql, parameters)
+	except sqlite3.OperationalError as oe:
+		print("Unable to read {} from the snapshot: {}".format(resource, oe))
+		exit(1)
+	for (data,) in rows:
+		record = parse_json(data)
+		if any(str(record.get(f)) not in v for f, v in late_filters.items()): continue
+		if fields: record = {f: record.get(f) for f in fields}
+		yield record
+
+def build(filename = DEFAULT_SNAPSHOT, resources = SNAPSHOT_RESOURCES, verbose = False):
+	'''
+	Download the resources and store them in a new snapshot.
+	The old snapshot is replaced only when the new one is complete.
+	'''
+	from downloader import iter_records # avoid a circular import
+	import sqlite3
+	makedirs(path.dirname(path.abspath(filename)), exist_ok = True)
+	temp_filename = filename + ".tmp"
+	if path.exists(temp_filename): remove(temp_filename)
+	connection = sqlite3.connect(temp_filename)
+	connection.execute("CREATE TABLE {} (resource TEXT PRIMARY KEY, records INTEGER, downloaded REAL)" \
+		.format(quote(METADATA_TABLE)))
+	for resource in resources:
+		indexed = [quote(f) for f in INDEXED_FIELDS]
+		connection.execute("CREATE TABLE {} ({}, {} TEXT NOT NULL)".format(quote(resource), \
+			", ".join(f + " TEXT" for f in indexed), RECORD_COLUMN))
+		insert = "INSERT INTO {} VALUES ({})".format(quote(resource), ", ".join("?" * (len(indexed) + 1)))
+		count = 0
+		batch = []
+		for record in iter_records(resource):
+			batch.append([None if record.get(f) is None else str(record[f]) for f in INDEXED_FIELDS] + \
+				[to_json_bytes(record)])
+			if len(batch) >= 1000:
+				connection.executemany(insert, batch)
+				count += len(batch)
+				batch = []
+		connection.executemany(insert, batch)
+		count += len(batch)
+		for field in INDEXED_FIELDS:
+			connection.execute("CREATE INDEX {} ON {} ({})".format(quote(resource + "_" + field), \
+				quote(resource), quote(field)))
+		connection.execute("INSERT INTO {} VALUES (?, ?, ?)".format(quote(METADATA_TABLE)), (resource, count, time()))
+		connection.commit()
+		if verbose: print("{}: {:d} records.".format(resource, count))
+	connection.close()
+	replace(temp_filename, filename)
+
+def parse_args():
+	parser = ArgumentParser(description = "Download the datastore resources into a local snapshot.")
+	parser.add_argument('-o', '--output', default = DEFAULT_SNAPSHOT, help = "Store the snapshot in this file.")
+	parser.add_argument('-v', '--verbose', action = 'store_true', help = "Print more information.")
+	args = parser.parse_args()
+	cache.configure(cache.MODE_DISABLED) # a snapshot must be fresh
+	return args.output, SNAPSHOT_RESOURCES, args.verbose
+
+if __name__ == '__main__':
+	build(*parse_args())
+	print("Done.")
@@ -0,0 +1,13 @@
+###
+# File: conftest.py
+#
+# Description: The modules of calendariounibo import each other as scripts
+#                (e.g. "import cache"), so their directory must be in the path.
+#
+# Author: Francesco Tosello
+###
+
+from os import path
+import sys
+
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), "calendariounibo"))
@@ -0,0 +1,84 @@
+###
+# File: test_cache.py
+#
+# Description: Tests of the on-disk cache: the query keys, the expiration,
+#                the LRU eviction and the cache modes.
+#
+# Author: Francesco Tosello
+###
+
+from os import listdir, path, stat, utime
+from time import time
+import pytest
+from api_constants import *
+import cache
+
+BODY = b'{"success": true}'
+
+
+@pytest.fixture(autouse = True)
+def directory(monkeypatch, tmp_path):
+	monkeypatch.setattr(cache, 'mode', cache.MODE_DEFAULT)
+	monkeypatch.setattr(cache, 'directory', str(tmp_path))
+	monkeypatch.setattr(cache, 'max_size', cache.CACHE_MAX_SIZE)
+	return tmp_path
+
+def age(key, seconds, accessed = None):
+	'''
+	Move back the modification (and set the access) time of an entry.
+	'''
+	filename = cache.entry_path(key)
+	utime(filename, (accessed if accessed is not None else stat(filename).st_atime, time() - seconds))
+
+
+def test_query_key():
+	key = cache.query_key(RESOURCE_TIMETABLES, {FIELD_TIMETABLE_TEACHING_ID: [2, 1]}, [], 10, 0)
+	assert key == cache.query_key(RESOURCE_TIMETABLES, {FIELD_TIMETABLE_TEACHING_ID: ["1", "2"]}, [], 10, 0)
+	assert key != cache.query_key(RESOURCE_TIMETABLES, {FIELD_TIMETABLE_TEACHING_ID: [1, 2]}, [], 10, 10)
+	assert key != cache.query_key(RESOURCE_TIMETABLES, {FIELD_TIMETABLE_TEACHING_ID: [1, 2]}, [], 10, 0, \
+		sort = FIELD_RECORD_ID)
+
+def test_stored_entries_are_loaded():
+	cache.store(RESOURCE_ROOMS, "k", BODY)
+	assert cache.load(RESOURCE_ROOMS, "k") == BODY
+	assert cache.load(RESOURCE_ROOMS, "missing") is None
+
+def test_entries_expire_after_the_ttl():
+	cache.store(RESOURCE_ROOMS, "k", BODY)
+	age("k", cache.RESOURCE_TTL[RESOURCE_ROOMS] - 60)
+	assert cache.load(RESOURCE_ROOMS, "k") == BODY
+	age("k", cache.RESOURCE_TTL[RESOURCE_ROOMS] + 60)
+	assert cache.load(RESOURCE_ROOMS, "k") is None
+
+def test_offline_mode_reads_the_expired_entries_and_writes_nothing(directory):
+	cache.store(RESOURCE_ROOMS, "k", BODY)
+	age("k", 10 * cache.DAY)
+	cache.configure(cache.MODE_OFFLINE)
+	assert cache.load(RESOURCE_ROOMS, "k") == BODY
+	cache.store(RESOURCE_ROOMS, "new", BODY)
+	assert not path.exists(cache.entry_path("new"))
+
+def test_refresh_mode_writes_without_reading():
+	cache.store(RESOURCE_ROOMS, "k", BODY)
+	cache.configure(cache.MODE_REFRESH)
+	assert cache.load(RESOURCE_ROOMS, "k") is None
+	cache.store(RESOURCE_ROOMS, "k", b'new')
+	cache.configure(cache.MODE_DEFAULT)
+	assert cache.load(RESOURCE_ROOMS, "k") == b'new'
+
+def test_disabled_mode_neither_reads_nor_writes(directory):
+	cache.store(RESOURCE_ROOMS, "k", BODY)
+	cache.configure(cache.MODE_DISABLED)
+	assert cache.load(RESOURCE_ROOMS, "k") is None
+	cache.store(RESOURCE_ROOMS, "new", BODY)
+	assert sorted(listdir(directory)) == ["k" + cache.CACHE_EXTENSION]
+
+def test_least_recently_used_entries_are_evicted(directory):
+	cache.configure(cache_max_size = 2 * len(BODY))
+	cache.store(RESOURCE_ROOMS, "a", BODY)
+	cache.store(RESOURCE_ROOMS, "b", BODY)
+	age("a", 0, time() - 200)
+	age("b", 0, time() - 100)
+	assert cache.load(RESOURCE_ROOMS, "a") == BODY # now the most recently used
+	cache.store(RESOURCE_ROOMS, "c", BODY)
+	assert sorted(listdir(directory)) == ["a" + cache.CACHE_EXTENSION, "c" + cache.CACHE_EXTENSION]
@@ -0,0 +1,71 @@
+###
+# File: test_fragments.py
+#
+# Description: Tests of the cache of the rendered events: the keys, the
+#                bounded LRU memory and the file of the next runs.
+#
+# Author: Francesco Tosello
+###
+
+import fragments
+from fragments import FragmentCache, content_key
+
+
+def fragment(text):
+	return (text, "x" * 5)
+
+
+def test_keys_depend_on_every_value_and_on_the_format(monkeypatch):
+	key = content_key("uid", 1, None)
+	assert key == content_key("uid", 1, None)
+	assert key != content_key("uid", 1, "") and key != content_key("uid", 1)
+	monkeypatch.setattr(fragments, 'FORMAT_VERSION', fragments.FORMAT_VERSION + 1)
+	assert key != content_key("uid", 1, None)
+
+def test_hits_and_misses():
+	cache = FragmentCache()
+	assert cache.get("a") is None
+	cache.put("a", fragment("aaaaa"))
+	assert cache.get("a") == fragment("aaaaa")
+	assert (cache.hits, cache.misses) == (1, 1)
+
+def test_least_recently_used_are_dropped():
+	cache = FragmentCache(max_size = 30) # three fragments
+	for key in "abc": cache.put(key, fragment(key * 5))
+	cache.get("a")
+	cache.put("d", fragment("ddddd"))
+	assert cache.get("b") is None
+	assert all(cache.get(key) for key in "acd")
+	assert cache.size == 30
+
+def test_replaced_fragment_is_counted_once():
+	cache = FragmentCache()
+	cache.put("a", fragment("aaaaa"))
+	cache.put("a", fragment("aa"))
+	assert cache.size == 7
+
+def test_saved_fragments_are_loaded(tmp_path):
+	filename = str(tmp_path / "sub" / fragments.FRAGMENTS_FILENAME)
+	cache = FragmentCache()
+	for key in "abc": cache.put(key, fragment(key * 5))
+	cache.get("a")
+	cache.save(filename)
+	loaded = FragmentCache(max_size = 20) # the most recently used fit
+	loaded.load(filename)
+	assert loaded.get("b") is None
+	assert loaded.get("c") == fragment("ccccc") and loaded.get("a") == fragment("aaaaa")
+
+def test_missing_or_broken_file_is_ignored(tmp_path):
+	cache = FragmentCache()
+	cache.load(str(tmp_path / "missing"))
+	broken = tmp_path / "broken"
+	broken.write_text("[[")
+	cache.load(str(broken))
+	assert cache.size == 0
+
+def test_clear():
+	cache = FragmentCache()
+	cache.put("a", fragment("aaaaa"))
+	cache.get("a")
+	cache.clear()
+	assert cache.get("a") is None and cache.size == 0 and cache.hits == 0
@@ -0,0 +1,74 @@
+###
+# File: test_incremental.py
+#
+# Description: Tests of the incremental export: the events of the previous
+#                calendar are read back and only the changed ones rewritten.
+#
+# Author: Francesco Tosello
+###
+
+from datetime import datetime, timedelta, timezone
+from io import StringIO
+from records import Lecture, Teaching
+from ics_writer import CalendarWriter, read_events
+from downloader import stream_events, lecture_uid
+
+ZONE = timezone(timedelta(hours = 1))
+START = datetime(2026, 11, 2, 9, tzinfo = ZONE)
+FIRST_RUN = datetime(2026, 10, 1, 12, tzinfo = timezone.utc)
+SECOND_RUN = datetime(2026, 10, 8, 12, tzinfo = timezone.utc)
+COURSES = {1: Teaching(1, None, 1, None, "ANALISI MATEMATICA (ABC)", "MARIO ROSSI", "ita", "http://x/1")}
+
+
+def lectures(location = "Aula A", days = range(4)):
+	return [Lecture(1, START + timedelta(days = d), START + timedelta(days = d, hours = 2), None, location, "A") \
+		for d in days]
+
+def export(timetables, previous = {}, created = FIRST_RUN):
+	'''
+	Returns the calendar text and the (added, changed, removed) counts.
+	'''
+	output = StringIO(newline = '')
+	with CalendarWriter(output, "test") as calendar:
+		stats = stream_events(calendar, COURSES, timetables, previous, created)
+	return output.getvalue(), stats
+
+def events(text):
+	return read_events(StringIO(text, newline = ''))
+
+
+def test_read_events_of_a_written_calendar():
+	timetables = lectures()
+	text, stats = export(timetables)
+	assert stats == (4, 0, 0)
+	previous = events(text)
+	assert set(previous) == set(lecture_uid(l) for l in timetables)
+	for event in previous.values():
+		assert event.created == FIRST_RUN and event.sequence == 0 and event.hash
+		assert event.block.startswith("BEGIN:VEVENT") and event.block in text
+
+def test_unchanged_events_are_copied():
+	text, _ = export(lectures())
+	again, stats = export(lectures(), events(text), SECOND_RUN)
+	assert stats == (0, 0, 0)
+	assert again == text # even the timestamps
+
+def test_changed_event_keeps_created_and_bumps_sequence():
+	text, _ = export(lectures())
+	timetables = lectures()
+	timetables[1].location = "Aula B"
+	again, stats = export(timetables, events(text), SECOND_RUN)
+	assert stats == (0, 1, 0)
+	changed = events(again)[lecture_uid(timetables[1])]
+	assert changed.created == FIRST_RUN and changed.sequence == 1
+	assert "LOCATION:Aula B" in changed.block and "DTSTAMP:20261008T120000Z" in changed.block
+	again, stats = export(timetables, events(again), SECOND_RUN)
+	assert stats == (0, 0, 0)
+
+def test_added_and_removed_events_are_counted():
+	text, _ = export(lectures(days = range(3)))
+	previous = events(text)
+	again, stats = export(lectures(days = range(1, 5)), previous, SECOND_RUN)
+	assert stats == (2, 0, 1)
+	assert list(previous) == [lecture_uid(lectures(days = [0])[0])] # what's left was removed
+	assert len(events(again)) == 4
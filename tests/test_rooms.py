@@ -0,0 +1,92 @@
+###
+# File: test_rooms.py
+#
+# Description: Tests of the rooms directory and of the lecture locations,
+#                with fake downloads.
+#
+# Author: Francesco Tosello
+###
+
+import pytest
+from api_constants import *
+from records import Room
+from scheduler import DatastoreError
+import cache
+import rooms
+
+SERVER = { # the rooms known by the fake datastore
+	"A1": Room("A1", "AULA UNO", "Via Zamboni, 33", "Piano terra", 44.49, 11.35),
+	"B2": Room("B2", "AULA DUE", None, None, None, None),
+	"C3": Room("C3", "LAB TRE", "Via Irnerio 46", None, 44.5, 11.36),
+}
+
+
+@pytest.fixture(autouse = True)
+def downloads(monkeypatch, tmp_path):
+	'''
+	The server knows all the rooms but C3 at first, every download is
+	 recorded with its filters.
+	'''
+	calls = []
+	known = {code: r for code, r in SERVER.items() if code != "C3"}
+	def download_rooms(filters = {}):
+		calls.append(filters)
+		codes = filters.get(FIELD_ROOMS_ROOM_ID, list(known))
+		return {code: known[code] for code in codes if code in known}
+	monkeypatch.setattr(rooms, 'download_rooms', download_rooms)
+	monkeypatch.setattr(rooms, 'directory', None)
+	monkeypatch.setattr(cache, 'mode', cache.MODE_DEFAULT)
+	monkeypatch.setattr(cache, 'directory', str(tmp_path))
+	rooms.build_location.cache_clear()
+	yield calls, known
+	rooms.build_location.cache_clear()
+
+
+def test_directory_is_downloaded_once_and_saved(downloads):
+	calls, known = downloads
+	assert set(rooms.get_directory()) == {"A1", "B2"}
+	rooms.get_directory()
+	assert len(calls) == 1
+	rooms.directory = None # a new run
+	assert set(rooms.get_directory()) == {"A1", "B2"}
+	assert len(calls) == 1
+
+def test_new_rooms_are_downloaded(downloads):
+	calls, known = downloads
+	rooms.get_directory()
+	known["C3"] = SERVER["C3"]
+	assert rooms.find_rooms(["A1", "C3", "Z9"]) == {"Z9"}
+	assert calls[-1] == {FIELD_ROOMS_ROOM_ID: ["C3", "Z9"]}
+	assert "C3" in rooms.get_directory()
+	assert rooms.find_rooms(["C3"]) == set() and len(calls) == 2
+
+def test_offline_the_new_rooms_are_left_out(downloads):
+	calls, known = downloads
+	rooms.get_directory()
+	cache.configure(cache.MODE_OFFLINE)
+	assert rooms.find_rooms(["A1", "C3"]) == {"C3"}
+	assert len(calls) == 1
+
+def test_failed_download_of_the_new_rooms(monkeypatch, downloads):
+	rooms.get_directory()
+	def fail(filters = {}):
+		raise DatastoreError("Unable to contact the server", True)
+	monkeypatch.setattr(rooms, 'download_rooms', fail)
+	assert rooms.find_rooms(["A1", "C3"]) == {"C3"}
+	assert rooms.build_location("A1 C3") == "Aula Uno - Piano terra in Via Zamboni 33 OPPURE C3"
+
+def test_locations():
+	rooms.get_directory()
+	assert rooms.build_location("") == ""
+	assert rooms.build_location("A1") == "Aula Uno - Piano terra in Via Zamboni 33"
+	assert rooms.build_location("B2") == "Aula Due"
+	assert rooms.build_location("A1", True) == "Aula Uno - 44.49 11.35"
+	assert rooms.build_location("B2 Z9", True) == "Aula Due OPPURE Z9"
+
+def test_locations_follow_the_new_rooms(downloads):
+	calls, known = downloads
+	rooms.get_directory()
+	assert rooms.build_location("C3") == "C3"
+	known["C3"] = SERVER["C3"]
+	rooms.find_rooms(["C3"])
+	assert rooms.build_location("C3") == "Lab Tre - in Via Irnerio 46"
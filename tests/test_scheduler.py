@@ -0,0 +1,136 @@
+###
+# File: test_scheduler.py
+#
+# Description: Tests of the request scheduler with fake requests: retries,
+#                backoff, hedging and the batches with their sizes.
+#
+# Author: Francesco Tosello
+###
+
+from threading import Lock
+from time import perf_counter, sleep
+import pytest
+import scheduler
+from scheduler import DatastoreError, BatchSizer
+
+
+@pytest.fixture(autouse = True)
+def state(monkeypatch):
+	'''
+	Every test starts without the learned latencies and batch sizes, and
+	 doesn't wait for the backoff: the delays are recorded instead.
+	'''
+	monkeypatch.setattr(scheduler, 'latencies', {})
+	monkeypatch.setattr(scheduler, 'sizers', {})
+	monkeypatch.setattr(scheduler, 'retries', 2)
+	monkeypatch.setattr(scheduler, 'hedging', False)
+	delays = []
+	monkeypatch.setattr(scheduler, 'sleep', delays.append)
+	return delays
+
+def responses(*answers):
+	'''
+	Returns a fake request giving these answers in turn (an exception is
+	 raised), and the list of its calls.
+	'''
+	answers = list(answers)
+	calls = []
+	def function():
+		calls.append(len(calls))
+		answer = answers.pop(0) if len(answers) > 1 else answers[0]
+		if isinstance(answer, Exception): raise answer
+		return answer
+	return function, calls
+
+
+def test_backoff_grows_and_is_bounded():
+	for attempt in range(1, 20):
+		assert 0 <= scheduler.backoff(attempt) <= min(scheduler.BACKOFF_MAX, scheduler.BACKOFF_BASE * 2 ** (attempt - 1))
+
+def test_send_returns_the_whole_response():
+	function, calls = responses((200, {}, b'ok', (10, 20)))
+	assert scheduler.send(function, "r") == (200, {}, b'ok', (10, 20))
+	assert len(calls) == 1 and len(scheduler.latencies["r"]) == 1
+
+def test_send_retries_the_transient_failures(state):
+	function, calls = responses((503, {}, b''), OSError("reset"), (200, {}, b'ok'))
+	assert scheduler.send(function, "r")[2] == b'ok'
+	assert len(calls) == 3 and len(state) == 2
+
+def test_send_gives_up_after_the_retries():
+	function, calls = responses((502, {}, b'bad gateway'))
+	with pytest.raises(DatastoreError) as error:
+		scheduler.send(function, "r")
+	assert error.value.transient and len(calls) == scheduler.retries + 1
+
+def test_send_does_not_retry_the_client_errors():
+	function, calls = responses((400, {}, b'bad request'))
+	with pytest.raises(DatastoreError) as error:
+		scheduler.send(function, "r")
+	assert not error.value.transient and len(calls) == 1
+
+def test_send_waits_retry_after(state):
+	function, calls = responses((429, {'Retry-After': '7'}, b''), (200, {}, b''))
+	scheduler.send(function, "r")
+	assert state[0] >= 7
+
+def test_slow_request_is_hedged(monkeypatch):
+	monkeypatch.setattr(scheduler, 'HEDGE_MIN_DELAY', 0.05)
+	scheduler.latencies["r"] = [0.01] * scheduler.HEDGE_MIN_SAMPLES
+	lock = Lock()
+	calls = []
+	def function():
+		with lock:
+			calls.append(len(calls))
+			first = len(calls) == 1
+		if first: sleep(1)
+		return (200, {}, b'first' if first else b'hedge')
+	start = perf_counter()
+	assert scheduler.hedged(function, "r")[2] == b'hedge'
+	assert perf_counter() - start < 0.9 and len(calls) == 2
+
+def test_no_hedge_without_latencies():
+	function, calls = responses((200, {}, b''))
+	scheduler.hedged(function, "r")
+	assert len(calls) == 1
+
+def test_batch_sizer():
+	sizer = BatchSizer(8, minimum = 2, maximum = 12, target = 1)
+	sizer.success(4, 0.1) # not full, it tells nothing
+	assert sizer.size == 8
+	sizer.success(8, 0.1)
+	assert sizer.size == 10
+	sizer.success(10, 0.1)
+	assert sizer.size == 12
+	sizer.success(12, 3)
+	assert sizer.size == 4
+	sizer.failure()
+	sizer.failure()
+	assert sizer.size == 2
+
+def test_batches_split_the_refused_ones():
+	batches = []
+	def function(batch):
+		batches.append(batch)
+		if len(batch) > 2: raise DatastoreError("filter too long")
+		return batch
+	results = list(scheduler.batches(function, range(8), "r", 8))
+	assert sorted(v for r in results for v in r) == list(range(8))
+	assert batches[0] == list(range(8)) and all(len(b) <= 2 for b in results)
+	assert scheduler.sizers["r"].size == scheduler.BATCH_MIN
+
+def test_batches_raise_the_transient_errors():
+	batches = []
+	def function(batch):
+		batches.append(batch)
+		raise DatastoreError("unable to contact the server", True)
+	with pytest.raises(DatastoreError):
+		list(scheduler.batches(function, range(50), "r", 50))
+	assert len(batches) == 1
+
+def test_batches_raise_when_a_single_value_fails():
+	def function(batch):
+		if 3 in batch: raise DatastoreError("bad value")
+		return batch
+	with pytest.raises(DatastoreError):
+		list(scheduler.batches(function, range(8), "r", 8))
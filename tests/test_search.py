@@ -0,0 +1,70 @@
+###
+# File: test_search.py
+#
+# Description: Tests of the teaching names index: the ranking of the word
+#                prefix search and the substring matching of the phrases.
+#
+# Author: Francesco Tosello
+###
+
+from types import SimpleNamespace
+from search import TeachingIndex, normalize
+
+DESCRIPTIONS = ["Analisi matematica e statistica", "Analisi matematica", "Analitica", "Fisica", "Attività pratiche"]
+
+
+def index():
+	return TeachingIndex(SimpleNamespace(description = d) for d in DESCRIPTIONS)
+
+
+def test_normalize_folds_case_and_accents():
+	assert normalize("Attività PRATICHE") == "attivita pratiche"
+
+def test_whole_words_come_first_then_shorter_texts():
+	assert index().search("analisi") == [1, 0]
+	assert index().search("anali") == [2, 1, 0]
+	assert index().search("anali", limit = 2) == [2, 1]
+
+def test_every_term_must_match():
+	assert index().search("mat anal") == [1, 0]
+	assert index().search("stat anal") == [0]
+	assert index().search("fisica anal") == []
+	assert index().search("") == []
+
+def test_terms_match_the_start_of_the_words():
+	assert index().search("nalisi") == []
+	assert index().search("ATTIVITA") == [4]
+
+def test_phrases_match_anywhere():
+	assert index().match_phrase("nalisi") == [0, 1]
+	assert index().match_phrase("matematica e") == [0]
+	assert index().match_phrase("tica") == [0, 1, 2]
+	assert index().match_phrase("attività pra") == [4]
+	assert index().match_phrase(" ") == []
+
+def test_records_added_later_are_found():
+	teachings = index()
+	position = teachings.add(SimpleNamespace(description = "Analisi 2"))
+	assert teachings.search("analisi") == [position, 1, 0]
+
+def test_text_of_a_function():
+	teachings = TeachingIndex([("Fisica", "Mario Rossi")], lambda r: " ".join(r))
+	assert teachings.search("ross") == [0]
+
+def test_short_phrases_are_found_too():
+	assert index().match_phrase("ti") == [0, 1, 2, 4]
+
+def test_phrases_across_words():
+	assert index().match_phrase("si mat") == [0, 1]
+	assert index().match_phrase("matica st") == []
+
+def test_words_match_anywhere_in_any_order():
+	assert index().match_words("tica nalisi") == [0, 1]
+	assert index().match_words("stat nalisi") == [0]
+	assert index().match_words("fisica nalisi") == []
+	assert index().match_words(" ") == []
+
+def test_candidates_narrow_the_scan():
+	teachings = index()
+	assert teachings.candidates("nalisi") == {0, 1}
+	assert teachings.candidates("xyz") == set()
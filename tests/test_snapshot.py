@@ -0,0 +1,58 @@
+###
+# File: test_snapshot.py
+#
+# Description: Tests of the offline snapshot: built from fake records, then
+#                queried like the datastore.
+#
+# Author: Francesco Tosello
+###
+
+import pytest
+from api_constants import *
+import downloader
+import snapshot
+
+iter_records = downloader.iter_records # replaced in the snapshot builds
+
+TIMETABLES = [{FIELD_TIMETABLE_TEACHING_ID: i % 3, FIELD_TIMETABLE_START: "2026-11-{:02d}T09:00:00".format(i + 1), \
+	FIELD_TIMETABLE_END: "2026-11-{:02d}T11:00:00".format(i + 1), FIELD_TIMETABLE_NOTES: "n{}".format(i % 2)} \
+	for i in range(9)]
+
+
+@pytest.fixture(autouse = True)
+def database(monkeypatch, tmp_path):
+	'''
+	A snapshot of the fake timetables, in use for the test.
+	'''
+	monkeypatch.setattr(downloader, 'iter_records', lambda resource: iter(TIMETABLES))
+	monkeypatch.setattr(snapshot, 'database', None)
+	filename = str(tmp_path / "snapshot.sqlite")
+	snapshot.build(filename, [RESOURCE_TIMETABLES])
+	snapshot.open_snapshot(filename)
+	return filename
+
+def query(*args, **kwargs):
+	return list(snapshot.query(RESOURCE_TIMETABLES, *args, **kwargs))
+
+
+def test_all_the_records_in_order():
+	assert query() == TIMETABLES
+
+def test_filters_with_alternatives():
+	assert query({FIELD_TIMETABLE_TEACHING_ID: 1}) == TIMETABLES[1::3]
+	assert query({FIELD_TIMETABLE_TEACHING_ID: [2, "0"]}) == [r for r in TIMETABLES if r[FIELD_TIMETABLE_TEACHING_ID] != 1]
+
+def test_filters_of_the_fields_not_indexed():
+	assert query({FIELD_TIMETABLE_NOTES: "n1", FIELD_TIMETABLE_TEACHING_ID: 0}) == [TIMETABLES[3]]
+
+def test_window():
+	window = (FIELD_TIMETABLE_START, "2026-11-03T00:00:00", "2026-11-05T23:59:59")
+	assert query(window = window) == TIMETABLES[2:5]
+	assert query(window = (FIELD_TIMETABLE_START, "2026-11-08T00:00:00", None)) == TIMETABLES[7:]
+
+def test_fields():
+	assert query({FIELD_TIMETABLE_TEACHING_ID: 2}, [FIELD_TIMETABLE_START]) == \
+		[{FIELD_TIMETABLE_START: r[FIELD_TIMETABLE_START]} for r in TIMETABLES[2::3]]
+
+def test_the_downloader_reads_the_snapshot():
+	assert list(iter_records(RESOURCE_TIMETABLES, {FIELD_TIMETABLE_TEACHING_ID: 0})) == TIMETABLES[::3]
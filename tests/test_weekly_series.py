@@ -0,0 +1,81 @@
+###
+# File: test_weekly_series.py
+#
+# Description: Tests of the weekly export: the grouping of the lectures in
+#                recurring series and the stability of their UIDs.
+#
+# Author: Francesco Tosello
+###
+
+from datetime import datetime, timedelta, timezone
+from records import Lecture
+from downloader import weekly_series, calendar_events
+
+ZONE = timezone(timedelta(hours = 1)) # winter time, as the datastore timestamps
+MONDAY = datetime(2026, 11, 2, 9, tzinfo = ZONE)
+
+
+def lecture(start, hours = 2, course_id = 1, location = "Aula A", rooms = "A"):
+	return Lecture(course_id, start, start + timedelta(hours = hours), None, location, rooms)
+
+def mondays(*weeks):
+	return [lecture(MONDAY + timedelta(weeks = w)) for w in weeks]
+
+
+def test_weekly_lectures_make_a_series():
+	items = weekly_series(mondays(0, 1, 2, 3))
+	assert len(items) == 1
+	lectures, weeks, exdates, rdates = items[0]
+	assert len(lectures) == 4 and weeks == 4
+	assert exdates == [] and rdates == []
+
+def test_skipped_weeks_are_exdates():
+	items = weekly_series(mondays(0, 1, 3, 4))
+	assert len(items) == 1
+	lectures, weeks, exdates, rdates = items[0]
+	assert weeks == 5
+	assert exdates == [(MONDAY + timedelta(weeks = 2)).replace(tzinfo = None)]
+
+def test_long_break_splits_the_series():
+	items = weekly_series(mondays(0, 1, 2, 6, 7, 8)) # 28 days between the runs
+	assert [(len(i[0]), i[1]) for i in items] == [(3, 3), (3, 3)]
+	assert all(i[2] == [] for i in items)
+
+def test_few_lectures_are_exported_alone():
+	items = weekly_series(mondays(0, 1))
+	assert [(len(i[0]), i[1]) for i in items] == [(1, None), (1, None)]
+
+def test_other_weekday_in_the_span_is_an_rdate():
+	wednesday = lecture(MONDAY + timedelta(days = 9))
+	items = weekly_series(mondays(0, 1, 2, 3) + [wednesday])
+	assert len(items) == 1
+	lectures, weeks, exdates, rdates = items[0]
+	assert len(lectures) == 4 and exdates == []
+	assert rdates == [wednesday.start.replace(tzinfo = None)]
+
+def test_other_weekday_outside_the_span_is_alone():
+	wednesday = lecture(MONDAY + timedelta(weeks = 4, days = 2))
+	items = weekly_series(mondays(0, 1, 2, 3) + [wednesday])
+	assert [(len(i[0]), i[1], i[3]) for i in items] == [(4, 4, []), (1, None, [])]
+
+def test_different_rooms_are_different_series():
+	timetables = mondays(0, 1, 2) + [lecture(MONDAY + timedelta(weeks = w), location = "Aula B", rooms = "B") \
+		for w in (0, 1, 2)]
+	items = weekly_series(timetables)
+	assert sorted(i[0][0].rooms for i in items) == ["A", "B"]
+
+def test_series_uid_survives_the_start_moving_forward():
+	timetables = mondays(0, 1, 2, 3, 4)
+	uids = [uid for uid, _, _ in calendar_events(timetables, True)]
+	later = [uid for uid, _, _ in calendar_events(timetables[2:], True)]
+	assert len(uids) == 1 and later == uids
+
+def test_series_with_the_same_key_have_distinct_uids():
+	uids = [uid for uid, _, _ in calendar_events(mondays(0, 1, 2, 6, 7, 8), True)]
+	assert len(set(uids)) == 2
+	later = [uid for uid, _, _ in calendar_events(mondays(7, 8, 9), True)]
+	assert later == uids[1:] # the last series keeps its UID
+
+def test_weekly_events_have_recurrences():
+	events = list(calendar_events(mondays(0, 1, 2) + [lecture(MONDAY + timedelta(weeks = 5, days = 1))], True))
+	assert [(e[2]['tzid'], e[2]['count']) for e in events] == [("Europe/Rome", 3), ("Europe/Rome", None)]